@@ -0,0 +1,92 @@
+"""
+Running aggregates over the patient registry for the Analytics dashboard.
+
+patient_db feeds every add/update/delete through RegistryStats.add/remove,
+so the dashboard reads a handful of counters instead of rebuilding a
+DataFrame from every record on each rerun.
+"""
+
+from collections import Counter
+
+from severity import record_severity
+
+
+def _day(record):
+    # Dates are stored as "YYYY-MM-DD HH:MM:SS"
+    return str(record.get("date") or "")[:10] or None
+
+
+def _age(record):
+    age = record.get("age")
+    return age if isinstance(age, (int, float)) and not isinstance(age, bool) else None
+
+
+class RegistryStats:
+    """Counts per department/status/sex/disease/severity/day plus running age sums."""
+
+    def __init__(self):
+        self.total = 0
+        self.by_spec = Counter()
+        self.by_status = Counter()
+        self.by_sex = Counter()
+        self.by_disease = Counter()
+        self.by_severity = Counter()
+        self.by_day = Counter()
+        self.by_age = Counter()
+        self.spec_sex = Counter()
+        self.spec_disease = Counter()
+        self.age_sum = 0
+        self.age_count = 0
+        self.spec_age_sum = Counter()
+        self.spec_age_count = Counter()
+
+    def _apply(self, record, sign):
+        spec = record.get("specialization")
+        sex = record.get("sex") or "Unknown"
+        disease = record.get("disease")
+        self.total += sign
+        self.by_spec[spec] += sign
+        self.by_status[record.get("status")] += sign
+        self.by_sex[sex] += sign
+        self.by_disease[disease] += sign
+        self.by_severity[record_severity(record)] += sign
+        self.spec_sex[(spec, sex)] += sign
+        self.spec_disease[(spec, disease)] += sign
+        day = _day(record)
+        if day:
+            self.by_day[day] += sign
+        age = _age(record)
+        if age is not None:
+            self.by_age[age] += sign
+            self.age_sum += sign * age
+            self.age_count += sign
+            self.spec_age_sum[spec] += sign * age
+            self.spec_age_count[spec] += sign
+
+    def add(self, record):
+        self._apply(record, 1)
+
+    def remove(self, record):
+        self._apply(record, -1)
+
+    def snapshot(self):
+        """Plain-dict copy, safe to hand to the UI while writes continue."""
+        def nonzero(counter):
+            return {k: v for k, v in counter.items() if v}
+
+        return {
+            "total": self.total,
+            "by_spec": nonzero(self.by_spec),
+            "by_status": nonzero(self.by_status),
+            "by_sex": nonzero(self.by_sex),
+            "by_disease": nonzero(self.by_disease),
+            "by_severity": nonzero(self.by_severity),
+            "by_day": nonzero(self.by_day),
+            "by_age": nonzero(self.by_age),
+            "spec_sex": nonzero(self.spec_sex),
+            "spec_disease": nonzero(self.spec_disease),
+            "avg_age": self.age_sum / self.age_count if self.age_count else 0,
+            "spec_avg_age": {
+                spec: self.spec_age_sum[spec] / n for spec, n in self.spec_age_count.items() if n
+            },
+        }
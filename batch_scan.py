@@ -0,0 +1,230 @@
+"""
+Batch scan mode: analyze many images (files, folders or ZIP archives) with a
+bounded worker pool and save the results to the patient registry in bulk.
+
+    python batch_scan.py films/ intake.zip --workers 8 --rate 4
+
+Without GEMINI_API_KEY the simulated scan is used, as in the app.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+from patient_db import add_records, next_patient_id
+from scan_pipeline import GEMINI_MODEL_VERSION, analyze_image, build_record, load_gemini_model
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+@dataclass
+class BatchItem:
+    """One image of a batch and what became of it."""
+    name: str
+    data: bytes = field(repr=False)
+    patient_id: str = None
+    result: dict = None
+    record: dict = None
+    error: str = None
+    from_cache: bool = False
+    seconds: float = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all worker threads."""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def _is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_zip(data_or_path, label=""):
+    """(name, bytes) for every image inside a ZIP archive."""
+    with zipfile.ZipFile(data_or_path) as zf:
+        for info in zf.infolist():
+            if not info.is_dir() and _is_image(info.filename):
+                yield f"{label}{info.filename}", zf.read(info)
+
+
+def collect_images(paths):
+    """(name, bytes) for image files, folders (recursively) and ZIP archives."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for fname in sorted(files):
+                    full = os.path.join(root, fname)
+                    if _is_image(fname):
+                        with open(full, 'rb') as f:
+                            yield full, f.read()
+                    elif fname.lower().endswith(".zip"):
+                        yield from iter_zip(full, label=f"{full}:")
+        elif path.lower().endswith(".zip"):
+            yield from iter_zip(path, label=f"{path}:")
+        elif _is_image(path):
+            with open(path, 'rb') as f:
+                yield path, f.read()
+
+
+def collect_uploads(uploaded_files):
+    """(name, bytes) from Streamlit uploads, expanding any ZIP archives."""
+    for up in uploaded_files:
+        if up.name.lower().endswith(".zip"):
+            yield from iter_zip(io.BytesIO(up.getvalue()), label=f"{up.name}:")
+        elif _is_image(up.name):
+            yield up.name, up.getvalue()
+
+
+def load_manifest(path):
+    """Patient details per image from a CSV with columns file,name,age,sex."""
+    manifest = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            age = row.get("age")
+            manifest[os.path.basename(row["file"])] = {
+                "name": row.get("name") or None,
+                "age": int(age) if age else None,
+                "sex": row.get("sex") or None,
+            }
+    return manifest
+
+
+def _patient_for(item, manifest):
+    """(name, age, sex) for an item; age and sex are None (unknown) unless the manifest gives them."""
+    base = os.path.basename(item.name.split(":")[-1])
+    info = (manifest or {}).get(base, {})
+    return (
+        info.get("name") or os.path.splitext(base)[0],
+        info.get("age"),
+        info.get("sex"),
+    )
+
+
+def run_batch(images, model=None, cache=None, workers=4, rate=None, save=True,
+              manifest=None, on_progress=None, model_version=GEMINI_MODEL_VERSION):
+    """
+    Scans every (name, bytes) in `images` on a pool of `workers` threads,
+    starting at most `rate` model calls per second. Finished items are handed
+    to on_progress(done, total, item) on the calling thread. Successful scans
+    are written to patient_db in one bulk insert when `save` is set; patient
+    IDs are only allocated then.
+    Returns the list of BatchItems in input order.
+    """
+    items = [BatchItem(name, data) for name, data in images]
+    limiter = RateLimiter(rate)
+
+    def scan(item):
+        start = time.perf_counter()
+        try:
+            if model is not None:
+                limiter.wait()
+            item.result, item.from_cache = analyze_image(model, item.data, cache=cache, model_version=model_version)
+        except Exception as e:
+            item.error = f"{type(e).__name__}: {e}"
+        item.seconds = time.perf_counter() - start
+        return item
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(scan, item) for item in items]
+        for done, future in enumerate(as_completed(futures), 1):
+            item = future.result()
+            if item.ok:
+                name, age, sex = _patient_for(item, manifest)
+                # IDs are only handed out for records that will be saved
+                item.patient_id = next_patient_id() if save else None
+                item.record = build_record(name, age, sex, item.patient_id, item.result)
+            if on_progress:
+                on_progress(done, len(items), item)
+
+    if save:
+        add_records([item.record for item in items if item.ok])
+    return items
+
+
+def main(argv=None):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    from inference_cache import InferenceCache
+    from inference_client import InferenceClient
+
+    parser = argparse.ArgumentParser(description="Batch-scan medical images into the MediScan registry")
+    parser.add_argument("paths", nargs="+", help="image files, folders or .zip archives")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent scans (default 4)")
+    parser.add_argument("--rate", type=float, default=None, help="max model calls per second")
+    parser.add_argument("--manifest", help="CSV with file,name,age,sex per image")
+    parser.add_argument("--no-save", action="store_true", help="don't write results to patient_db")
+    parser.add_argument("--save-simulated", action="store_true",
+                        help="save simulated scans (no API key) to patient_db anyway")
+    parser.add_argument("--no-cache", action="store_true", help="don't reuse cached scan results")
+    parser.add_argument("--out", help="write per-item results as JSON lines to this file")
+    args = parser.parse_args(argv)
+
+    model = load_gemini_model()
+    if model is None:
+        # Every film would get the same canned diagnosis in the live registry
+        if not args.no_save and not args.save_simulated:
+            parser.error("GEMINI_API_KEY not set or SDK missing: scans would be simulated. "
+                         "Pass --no-save to preview, or --save-simulated to save them anyway")
+        print("GEMINI_API_KEY not set or SDK missing: using simulated scans", file=sys.stderr)
+    else:
+        model = InferenceClient(model, max_concurrency=args.workers)
+    cache = None if args.no_cache else InferenceCache(namespace="scan")
+    manifest = load_manifest(args.manifest) if args.manifest else None
+
+    def report(done, total, item):
+        if item.ok:
+            tag = " (cached)" if item.from_cache else ""
+            print(f"[{done}/{total}] {item.name}: {item.patient_id or '(not saved)'} {item.result.get('organ', '?')}"
+                  f" -> {item.record['specialization']} in {item.seconds:.2f}s{tag}")
+        else:
+            print(f"[{done}/{total}] {item.name}: FAILED {item.error}", file=sys.stderr)
+
+    start = time.perf_counter()
+    items = run_batch(collect_images(args.paths), model=model, cache=cache, workers=args.workers,
+                      rate=args.rate, save=not args.no_save, manifest=manifest, on_progress=report)
+    elapsed = time.perf_counter() - start
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            for item in items:
+                f.write(json.dumps({"file": item.name, "patient_id": item.patient_id, "result": item.result,
+                                    "error": item.error, "cached": item.from_cache, "seconds": item.seconds}) + "\n")
+
+    failed = sum(1 for i in items if not i.ok)
+    print(f"{len(items)} images, {len(items) - failed} scanned, {failed} failed in {elapsed:.1f}s"
+          f" ({len(items) / elapsed if elapsed else 0:.1f} images/s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Benchmarks patient_db operations against synthetic registries of growing size,
+for each storage backend, so storage regressions show up before the clinic
+does.
+
+    python bench_patient_db.py                                  # 1k/10k/100k, all backends
+    python bench_patient_db.py --sizes 1000000 --backends sqlite --json results.json
+
+Every registry is generated from a fixed seed in a temporary directory.
+Results are printed as a table and, with --json, written as one
+machine-readable document (latency percentiles in ms and ops/sec for each
+backend, size and operation).
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import patient_db
+from db_backends import SqliteBackend, _write_json_atomic
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+BACKENDS = ["json", "journal", "sqlite"]
+OPERATIONS = ["load", "add_record", "find_by_id", "search", "filter_records", "update_record", "delete_record"]
+
+FIRST_NAMES = ["Aarav", "Vivaan", "Aditya", "Ananya", "Diya", "Ishaan", "Kavya", "Rahul", "Priya", "Rohan",
+               "Sneha", "Arjun", "Meera", "Karan", "Neha", "Vikram", "Pooja", "Amit", "Riya", "Sanjay",
+               "James", "Maria", "Wei", "Fatima", "Olga", "Kenji", "Amara", "Lucas", "Sofia", "Omar"]
+LAST_NAMES = ["Kumar", "Sharma", "Patel", "Singh", "Gupta", "Reddy", "Iyer", "Nair", "Das", "Mehta",
+              "Joshi", "Khan", "Bose", "Rao", "Verma", "Smith", "Garcia", "Chen", "Ali", "Ivanova"]
+# (condition, department, relative frequency): a few common conditions dominate
+CONDITIONS = [
+    ("Opacification", "pulmonologist", 30), ("Pneumonia", "pulmonologist", 22),
+    ("Mild infiltration", "pulmonologist", 12), ("Hairline fracture", "orthopedist", 25),
+    ("Displaced fracture", "orthopedist", 10), ("Joint inflammation", "orthopedist", 8),
+    ("Cardiomegaly", "cardiologist", 15), ("Pulmonary congestion", "cardiologist", 9),
+    ("Slight arrhythmia", "cardiologist", 6), ("Brain tumor", "neurologist", 4),
+    ("Minor concussion", "neurologist", 7), ("Fatty liver", "hepatologist", 8),
+    ("Kidney stone", "nephrologist", 9), ("Sinus infection", "ent specialist", 7),
+    ("Mild rash", "dermatologist", 6), ("Cataract", "ophthalmologist", 5),
+    ("Gastritis", "gastroenterologist", 8), ("Ovarian cyst", "gynecologist", 3),
+    ("Unknown", "general", 10),
+]
+STATUS_WEIGHTS = [("Pending Review", 50), ("Reviewed", 35), ("Discharged", 15)]
+
+
+def synthetic_records(n, seed=0, start_number=patient_db.FIRST_PATIENT_NUMBER):
+    """n registry records with realistic name/age/condition/department/status mixes over two years."""
+    rng = random.Random(seed)
+    conditions, weights = [c[:2] for c in CONDITIONS], [c[2] for c in CONDITIONS]
+    statuses, status_weights = zip(*STATUS_WEIGHTS)
+    start = datetime.datetime(2024, 1, 1)
+    span = 2 * 365 * 24 * 3600
+    records = []
+    for i in range(n):
+        disease, spec = rng.choices(conditions, weights)[0]
+        rec = patient_db.make_patient_entry(
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            min(100, max(0, int(rng.gauss(45, 18)))),
+            rng.choice(["Male", "Female", "Female", "Male", "Other"]),
+            f"PID-{start_number + i}",
+            disease,
+            spec,
+        )
+        rec["date"] = (start + datetime.timedelta(seconds=rng.randrange(span))).strftime("%Y-%m-%d %H:%M:%S")
+        rec["status"] = rng.choices(statuses, status_weights)[0]
+        records.append(rec)
+    return records
+
+
+def seed_registry(backend, path, records):
+    """Writes `records` straight to storage, bypassing the per-write path being measured."""
+    if backend == "sqlite":
+        db = SqliteBackend(path)
+        db.add_many(records)
+        db.close()
+    else:
+        # The journal backend uses the JSON file as its snapshot
+        _write_json_atomic(path, records)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples, wall):
+    samples = sorted(samples)
+    ms = lambda s: round(s * 1000, 4)
+    return {
+        "n": len(samples),
+        "mean_ms": ms(sum(samples) / len(samples)) if samples else 0.0,
+        "p50_ms": ms(percentile(samples, 50)),
+        "p90_ms": ms(percentile(samples, 90)),
+        "p99_ms": ms(percentile(samples, 99)),
+        "max_ms": ms(samples[-1]) if samples else 0.0,
+        "ops_per_sec": round(len(samples) / wall, 2) if wall else 0.0,
+    }
+
+
+def _measure(fn, args_iter, ops, budget):
+    """Runs fn(*args) up to `ops` times or until `budget` seconds have passed."""
+    samples = []
+    started = time.perf_counter()
+    for args in args_iter:
+        if len(samples) >= ops or (samples and time.perf_counter() - started > budget):
+            break
+        t = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - t)
+    return samples, time.perf_counter() - started
+
+
+def bench_registry(backend, size, ops=200, budget=10.0, seed=0):
+    """Latency summaries per operation for one backend at one registry size."""
+    rng = random.Random(seed + 1)
+    records = synthetic_records(size, seed)
+    ids = [r["id"] for r in records]
+    names = sorted({r["name"] for r in records})
+    terms = [n.split()[0][:4] for n in names] + [c[0].split()[-1][:5] for c in CONDITIONS]
+    specs = sorted({c[1] for c in CONDITIONS})
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix="mediscan-bench-") as tmp:
+        path = os.path.join(tmp, "registry.db" if backend == "sqlite" else "registry.json")
+        seed_registry(backend, path, records)
+        del records
+        patient_db.configure(backend, path)
+
+        # Cold start: first read parses storage and builds every index
+        t = time.perf_counter()
+        patient_db.count()
+        load = time.perf_counter() - t
+        results["load"] = summarize([load], load)
+
+        fresh = iter(synthetic_records(ops, seed + 2, start_number=patient_db.FIRST_PATIENT_NUMBER + size))
+        results["add_record"] = summarize(*_measure(patient_db.add_record, ((r,) for r in fresh), ops, budget))
+
+        lookups = ((rng.choice(ids),) for _ in iter(int, 1))
+        results["find_by_id"] = summarize(*_measure(patient_db.find_by_id, lookups, ops, budget))
+
+        queries = ((rng.choice(terms),) for _ in iter(int, 1))
+        results["search"] = summarize(*_measure(patient_db.search, queries, ops, budget))
+
+        filters = ((rng.choice(specs), None, None, None, 25) for _ in iter(int, 1))
+        results["filter_records"] = summarize(*_measure(patient_db.filter_records, filters, ops, budget))
+
+        updates = ((rng.choice(ids), {"status": rng.choice(patient_db.STATUSES)}) for _ in iter(int, 1))
+        results["update_record"] = summarize(*_measure(patient_db.update_record, updates, ops, budget))
+
+        victims = rng.sample(ids, min(len(ids), ops))
+        results["delete_record"] = summarize(*_measure(patient_db.delete_record, ((pid,) for pid in victims), ops, budget))
+
+        # Release file handles before the directory goes away
+        patient_db._close_backend()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark patient_db operations at scale")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated registry sizes (e.g. 1000,10000,100000,1000000)")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="comma-separated subset of json,journal,sqlite")
+    parser.add_argument("--ops", type=int, default=200, help="operations measured per type")
+    parser.add_argument("--budget", type=float, default=10.0, help="max seconds spent per operation type")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    report = {
+        "benchmark": "patient_db",
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ops": args.ops,
+        "budget_s": args.budget,
+        "seed": args.seed,
+        "results": [],
+    }
+
+    print(f"{'backend':<8} {'size':>8} {'operation':<15} {'n':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'ops/s':>10}",
+          file=sys.stderr)
+    for size in sizes:
+        for backend in backends:
+            for op, summary in bench_registry(backend, size, args.ops, args.budget, args.seed).items():
+                report["results"].append({"backend": backend, "size": size, "operation": op, **summary})
+                print(f"{backend:<8} {size:>8} {op:<15} {summary['n']:>5} {summary['p50_ms']:>9.3f} "
+                      f"{summary['p90_ms']:>9.3f} {summary['p99_ms']:>9.3f} {summary['ops_per_sec']:>10.1f}",
+                      file=sys.stderr)
+
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+End-to-end benchmark of the scan tab's path, run headless: decode, progress,
+inference, JSON parse, annotation, registry save, clinical narrative and PDF,
+one patient per job, at several concurrency levels.
+
+    python bench_pipeline.py                                    # 48 jobs at 1/4/16 workers
+    python bench_pipeline.py --latency 0.8 --failure-rate 0.1 --concurrency 1,8,32 --json results.json
+
+Inference goes to fake_gemini.FakeModel (configurable latency, jitter and
+failure rate) through the same InferenceClient the app uses, so it runs
+offline and deterministically. Scans are synthetic X-ray-like images and
+records go to a registry in a temporary directory.
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops
+
+import patient_db
+from bench_patient_db import seed_registry, summarize
+from fake_gemini import FakeModel
+from inference_cache import stream_text
+from inference_client import InferenceClient
+from pdf_gen import create_medical_pdf
+from scan_pipeline import GEMINI_MODEL_VERSION, SCAN_STAGES, ScanImages, analyze_image, build_record, narrative_prompt
+from utils import StageProgress, timestamp_now
+
+PIPELINE_STAGES = SCAN_STAGES + ("annotate", "save", "narrative", "pdf")
+DEFAULT_CONCURRENCY = [1, 4, 16]
+
+
+class _HeadlessBar:
+    """Stands in for st.progress so StageProgress runs (and is timed) outside Streamlit."""
+
+    def progress(self, value, text=None):
+        return self
+
+    def empty(self):
+        pass
+
+
+def synthetic_scans(count, size=2048, seed=0):
+    """`count` distinct X-ray-like PNGs (grayscale saved as RGB, as exported scans often are)."""
+    scans = []
+    for i in range(count):
+        noise = Image.effect_noise((size, size), 30 + (seed + i) % 20)
+        body = Image.radial_gradient("L").resize((size, size)).point(lambda v: 255 - v)
+        img = ImageChops.multiply(body, noise).convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, "PNG")
+        scans.append(buf.getvalue())
+    return scans
+
+
+def run_job(client, image_bytes, pid):
+    """
+    One patient through the whole pipeline. Returns (timings, error): seconds
+    per stage finished, and the exception that stopped the job (or None).
+    """
+    progress = StageProgress(_HeadlessBar(), PIPELINE_STAGES)
+    with progress:
+        try:
+            images = ScanImages(image_bytes)
+            result, _ = analyze_image(client, images.data, images.image, on_stage=progress)
+            jpeg = images.jpeg(result)
+            progress("annotate")
+            patient_db.add_record(build_record(f"Bench {pid}", 50, "Other", pid, result))
+            progress("save")
+            chunks, _ = stream_text(client, narrative_prompt(result), GEMINI_MODEL_VERSION)
+            narrative = "".join(chunks)
+            progress("narrative")
+            patient = {"name": f"Bench {pid}", "age": 50, "sex": "Other", "id": pid, "date": timestamp_now()}
+            create_medical_pdf(patient, result, narrative, image=jpeg)
+            progress("pdf")
+        except Exception as e:
+            return progress.timings, e
+    return progress.timings, None
+
+
+def bench_level(model, scans, jobs, concurrency, retries=3, backoff=0.05, timeout=30.0, tag=""):
+    """Stage and end-to-end summaries for `jobs` patients pushed through `concurrency` workers."""
+    client = InferenceClient(model, timeout=timeout, max_retries=retries, backoff=backoff,
+                             max_concurrency=concurrency, breaker_reset=1.0)
+    stage_samples = {stage: [] for stage in PIPELINE_STAGES}
+    totals, errors = [], {}
+
+    def job(i):
+        t = time.perf_counter()
+        timings, error = run_job(client, scans[i % len(scans)], f"PID-BENCH{tag}-{i}")
+        return timings, error, time.perf_counter() - t
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for timings, error, total in pool.map(job, range(jobs)):
+                for stage, secs in timings.items():
+                    stage_samples[stage].append(secs)
+                if error is None:
+                    totals.append(total)
+                else:
+                    name = type(error).__name__
+                    errors[name] = errors.get(name, 0) + 1
+    finally:
+        client.close()
+    wall = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "jobs": jobs,
+        "ok": len(totals),
+        "failed": jobs - len(totals),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "jobs_per_sec": round(len(totals) / wall, 2) if wall else 0.0,
+        "model_calls": client.calls,
+        "retries": client.retries,
+        "end_to_end": summarize(totals, wall),
+        # ops_per_sec here is per-stage work over the whole run's wall time
+        "stages": {stage: summarize(samples, wall) for stage, samples in stage_samples.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scan pipeline end to end with a fake model")
+    parser.add_argument("--jobs", type=int, default=48, help="patients pushed through per concurrency level")
+    parser.add_argument("--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)),
+                        help="comma-separated worker counts (e.g. 1,4,16)")
+    parser.add_argument("--latency", type=float, default=0.25, help="fake model seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.05, help="extra random seconds per call, up to")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="fake seconds between streamed words")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability each model call fails")
+    parser.add_argument("--failure-status", type=int, default=503, help="HTTP status of injected failures")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--images", type=int, default=8, help="distinct synthetic scans")
+    parser.add_argument("--image-size", type=int, default=2048, help="edge of the synthetic scans in px")
+    parser.add_argument("--backend", default="sqlite", choices=["json", "journal", "sqlite"],
+                        help="registry backend records are saved to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    scans = synthetic_scans(args.images, args.image_size, args.seed)
+    report = {
+        "benchmark": "pipeline",
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "concurrency")},
+        "results": [],
+    }
+
+    header = f"{'workers':>7} {'ok':>5} {'fail':>5} {'jobs/s':>8} {'p50 s':>7} {'p99 s':>7}  " + \
+             " ".join(f"{s[:9]:>9}" for s in PIPELINE_STAGES)
+    print(header + "   (stage columns: p50 ms)", file=sys.stderr)
+    with tempfile.TemporaryDirectory(prefix="mediscan-bench-") as tmp:
+        for level in levels:
+            model = FakeModel(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                              failure_status=args.failure_status, seed=args.seed, token_latency=args.token_latency)
+            path = os.path.join(tmp, f"registry-{level}.{'db' if args.backend == 'sqlite' else 'json'}")
+            # Start from an explicitly empty registry so no existing records are
+            # imported into it and "save" times only the benchmark's own writes
+            seed_registry(args.backend, path, [])
+            patient_db.configure(args.backend, path)
+            if patient_db.count():
+                parser.error(f"benchmark registry {path} is not empty")
+            result = bench_level(model, scans, args.jobs, level, args.retries, tag=f"-{level}")
+            patient_db._close_backend()
+            report["results"].append(result)
+            e2e = result["end_to_end"]
+            print(f"{level:>7} {result['ok']:>5} {result['failed']:>5} {result['jobs_per_sec']:>8.2f} "
+                  f"{e2e['p50_ms'] / 1000:>7.2f} {e2e['p99_ms'] / 1000:>7.2f}  " +
+                  " ".join(f"{result['stages'][s]['p50_ms']:>9.1f}" for s in PIPELINE_STAGES),
+                  file=sys.stderr)
+            if result["errors"]:
+                print(f"{'':>7} errors: {result['errors']}", file=sys.stderr)
+
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,487 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Exclusive advisory lock on a side file, shared by every process using the
+    same registry. Re-entrant within one process; callers serialize threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0:
+            fh = open(self.path, 'a+')
+            if fcntl:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+            self._fh = fh
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            else:
+                self._fh.seek(0)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+            self._fh.close()
+            self._fh = None
+        return False
+
+
+def _write_json_atomic(path, data):
+    """Writes `data` to a temp file, fsyncs it and renames it over `path`."""
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def apply_op(data, op):
+    """Applies one journal operation to a list of records, exactly as the JSON backend would."""
+    kind = op["op"]
+    if kind == "add":
+        data.append(op["record"])
+    elif kind == "update":
+        for rec in data:
+            if rec["id"] == op["id"]:
+                rec.update(op["updates"])
+                break
+    elif kind == "delete":
+        data[:] = [r for r in data if r["id"] != op["id"]]
+    return data
+
+
+def _last_line_end(f, size, chunk=65536):
+    """Offset just past the last newline in the first `size` bytes of binary file `f` (0 if none)."""
+    end = size
+    while end > 0:
+        start = max(0, end - chunk)
+        f.seek(start)
+        i = f.read(end - start).rfind(b"\n")
+        if i >= 0:
+            return start + i + 1
+        end = start
+    return 0
+
+
+class JsonBackend:
+    """Stores all records as a single JSON array on disk."""
+
+    name = "json"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = FileLock(path + ".lock")
+
+    def lock(self):
+        """Cross-process write lock; hold it across read-modify-write cycles."""
+        return self._lock
+
+    def _save(self, data):
+        # Readers only ever see the old or the new file, never a half-written one.
+        _write_json_atomic(self.path, data)
+
+    def load_all(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+            except:
+                return []
+        return []
+
+    def signature(self):
+        """
+        Changes whenever the file is rewritten; None if it is missing. Every
+        write renames a new file into place, so the inode changes even when a
+        write lands in the same mtime tick and leaves the size unchanged.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get(self, pid):
+        for r in self.load_all():
+            if r["id"] == pid:
+                return r
+        return None
+
+    # `records`, when given, is the caller's already-loaded copy of the file
+    # contents; it saves parsing the whole file again just to rewrite it.
+
+    def add(self, record, records=None):
+        data = list(records) if records is not None else self.load_all()
+        data.append(record)
+        self._save(data)
+        return True
+
+    def add_many(self, new_records, records=None):
+        """Appends all of `new_records` with a single rewrite of the file."""
+        data = list(records) if records is not None else self.load_all()
+        data.extend(new_records)
+        self._save(data)
+        return len(new_records)
+
+    def update(self, pid, updates, records=None):
+        data = list(records) if records is not None else self.load_all()
+        for i, rec in enumerate(data):
+            if rec["id"] == pid:
+                data[i] = {**rec, **updates}
+                self._save(data)
+                return True
+        return False
+
+    def delete(self, pid, records=None):
+        data = records if records is not None else self.load_all()
+        initial_len = len(data)
+        data = [r for r in data if r["id"] != pid]
+        if len(data) < initial_len:
+            self._save(data)
+            return True
+        return False
+
+
+class JournalBackend(JsonBackend):
+    """
+    JSON snapshot plus an append-only JSONL journal of add/update/delete operations.
+
+    Every write appends one line and flushes it, so a process crash loses
+    nothing; fsync runs once FSYNC_EVERY operations are unsynced, and a timer
+    syncs the rest at most FSYNC_INTERVAL seconds after they were written,
+    even if no further write comes. That bounds what an OS crash can drop.
+    Once the journal holds COMPACT_EVERY operations it is folded into the
+    snapshot.
+    """
+
+    name = "journal"
+
+    FSYNC_EVERY = 16
+    FSYNC_INTERVAL = 1.0
+    COMPACT_EVERY = 1000
+
+    def __init__(self, path, fsync_every=None, fsync_interval=None, compact_every=None):
+        super().__init__(path)
+        self.journal_path = path + ".journal"
+        self.fsync_every = fsync_every or self.FSYNC_EVERY
+        self.fsync_interval = fsync_interval if fsync_interval is not None else self.FSYNC_INTERVAL
+        self.compact_every = compact_every or self.COMPACT_EVERY
+        self._journal = None
+        self._pending = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        # Guards the journal file against the background sync timer
+        self._io_lock = threading.RLock()
+        self._sync_timer = None
+        self._recover()
+
+    def _recover(self):
+        """
+        Finishes or discards a compaction that was interrupted by a crash.
+        Compaction writes `<path>.tmp`, renames the journal to `<journal>.done`,
+        renames the tmp file over the snapshot and finally removes `.done`.
+        """
+        tmp, done = self.path + ".tmp", self.journal_path + ".done"
+        with self._lock:
+            if os.path.exists(done):
+                if os.path.exists(tmp):
+                    os.replace(tmp, self.path)
+                os.remove(done)
+            elif os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _read_journal(self):
+        """
+        Returns the journal operations. A line torn by a crash mid-append is
+        skipped; the next writer cuts it off before appending (see _append_ops).
+        """
+        if not os.path.exists(self.journal_path):
+            return []
+        ops = []
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Still being written (or torn); not committed yet.
+                    break
+                try:
+                    ops.append(json.loads(line))
+                except ValueError:
+                    continue
+        return ops
+
+    def _open_journal(self):
+        if self._journal is not None:
+            # Another process may have compacted and replaced the journal file.
+            try:
+                same = os.path.samestat(os.fstat(self._journal.fileno()), os.stat(self.journal_path))
+            except OSError:
+                same = False
+            if not same:
+                self._journal.close()
+                self._journal = None
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'ab')
+        return self._journal
+
+    def _close_journal(self):
+        with self._io_lock:
+            if self._journal is not None:
+                self.sync()
+                self._journal.close()
+                self._journal = None
+
+    def sync(self):
+        """Forces buffered journal writes to disk."""
+        with self._io_lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            if self._journal is not None and self._unsynced:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def _schedule_sync(self):
+        """Makes sure unsynced writes reach the disk within fsync_interval, even if the process goes idle."""
+        if self._sync_timer is None:
+            self._sync_timer = threading.Timer(self.fsync_interval, self.sync)
+            self._sync_timer.daemon = True
+            self._sync_timer.start()
+
+    def close(self):
+        self._close_journal()
+
+    def signature(self):
+        try:
+            st = os.stat(self.journal_path)
+            # Appends grow the size; compaction starts a new file (new inode)
+            journal = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            journal = None
+        return (super().signature(), journal)
+
+    def load_all(self):
+        data = super().load_all()
+        ops = self._read_journal()
+        self._pending = len(ops)
+        for op in ops:
+            apply_op(data, op)
+        return data
+
+    def compact(self, records=None):
+        """Folds the journal into the snapshot and starts an empty journal."""
+        data = records if records is not None else self.load_all()
+        self._close_journal()
+        tmp, done = self.path + ".tmp", self.journal_path + ".done"
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(self.journal_path):
+            os.replace(self.journal_path, done)
+        os.replace(tmp, self.path)
+        if os.path.exists(done):
+            os.remove(done)
+        self._pending = 0
+
+    def _append(self, op, records):
+        self._append_ops([op], records)
+
+    def _append_ops(self, ops, records):
+        with self._io_lock:
+            if self._pending >= self.compact_every:
+                # `records` is the state before this op, i.e. snapshot + journal.
+                self.compact(records)
+            f = self._open_journal()
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                with open(self.journal_path, 'rb') as tail:
+                    tail.seek(size - 1)
+                    if tail.read(1) != b"\n":
+                        # Drop a line torn by a crashed writer. Terminating it instead
+                        # would commit it if only the newline was lost.
+                        os.truncate(self.journal_path, _last_line_end(tail, size))
+            f.write(b"".join(json.dumps(op).encode() + b"\n" for op in ops))
+            f.flush()
+            self._pending += len(ops)
+            self._unsynced += len(ops)
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self.sync()
+            else:
+                self._schedule_sync()
+
+    def add(self, record, records=None):
+        self._append({"op": "add", "record": record}, records)
+        return True
+
+    def add_many(self, new_records, records=None):
+        """One journal line per record, written and synced together."""
+        self._append_ops([{"op": "add", "record": r} for r in new_records], records)
+        return len(new_records)
+
+    # With `records` given the caller has already checked that `pid` exists,
+    # which keeps update/delete O(1) as well.
+
+    def update(self, pid, updates, records=None):
+        if records is None and self.get(pid) is None:
+            return False
+        self._append({"op": "update", "id": pid, "updates": updates}, records)
+        return True
+
+    def delete(self, pid, records=None):
+        if records is None and self.get(pid) is None:
+            return False
+        self._append({"op": "delete", "id": pid}, records)
+        return True
+
+
+class SqliteBackend:
+    """
+    Stores one row per record in SQLite (WAL mode, primary key on id).
+    The full record is kept as JSON in `data`; the columns we filter on are
+    mirrored next to it so they can be indexed.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS records (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        specialization TEXT,
+        status TEXT,
+        date TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_records_specialization ON records (specialization COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_records_status ON records (status);
+    CREATE INDEX IF NOT EXISTS idx_records_date ON records (date);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = FileLock(path + ".lock")
+
+    def lock(self):
+        """Cross-process write lock; hold it across read-modify-write cycles."""
+        return self._lock
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _row_values(record):
+        return (
+            record["id"],
+            record.get("name"),
+            record.get("specialization"),
+            record.get("status"),
+            record.get("date"),
+            json.dumps(record),
+        )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def signature(self):
+        """SQLite bumps data_version when another connection commits."""
+        return self._connect().execute("PRAGMA data_version").fetchone()[0]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def load_all(self):
+        rows = self._connect().execute("SELECT data FROM records ORDER BY rowid")
+        return [json.loads(data) for (data,) in rows]
+
+    def get(self, pid):
+        row = self._connect().execute("SELECT data FROM records WHERE id = ?", (pid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, record, records=None):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", self._row_values(record))
+        except sqlite3.IntegrityError:
+            # Patient IDs are unique here; a second save of the same ID is ignored.
+            return False
+        return True
+
+    def add_many(self, new_records, records=None):
+        """Bulk insert, keeping the first occurrence of any duplicated ID."""
+        conn = self._connect()
+        with conn:
+            cur = conn.executemany(
+                "INSERT OR IGNORE INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                (self._row_values(r) for r in new_records),
+            )
+        return cur.rowcount
+
+    def update(self, pid, updates, records=None):
+        conn = self._connect()
+        with conn:
+            row = conn.execute("SELECT data FROM records WHERE id = ?", (pid,)).fetchone()
+            if not row:
+                return False
+            rec = json.loads(row[0])
+            rec.update(updates)
+            conn.execute(
+                "UPDATE records SET id = ?, name = ?, specialization = ?, status = ?, date = ?, data = ? WHERE id = ?",
+                self._row_values(rec) + (pid,),
+            )
+        return True
+
+    def delete(self, pid, records=None):
+        conn = self._connect()
+        with conn:
+            cur = conn.execute("DELETE FROM records WHERE id = ?", (pid,))
+        return cur.rowcount > 0
+
+
+BACKENDS = {
+    JsonBackend.name: JsonBackend,
+    JournalBackend.name: JournalBackend,
+    SqliteBackend.name: SqliteBackend,
+}
+
+
+def open_backend(kind, path):
+    """Instantiates the backend registered under `kind`."""
+    try:
+        cls = BACKENDS[kind.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown patient_db backend '{kind}'. Choose one of: {', '.join(BACKENDS)}")
+    return cls(path)
@@ -1,6 +1,6 @@
 # doctor_portal.py
 import streamlit as st
-from patient_db import load_all, search, find_by_id
+from patient_db import by_specialization, search, find_by_id
 from utils import timestamp_now
 
 DOCTOR_CREDENTIALS = {
@@ -40,7 +40,7 @@ if st.session_state.doctor_logged_in:
     if q:
         results = search(q, specialization=st.session_state.doctor_specialization)
     else:
-        results = [r for r in load_all() if r.get("specialization","General").lower()==st.session_state.doctor_specialization.lower()]
+        results = by_specialization(st.session_state.doctor_specialization)
     if results:
         import pandas as pd
         st.dataframe(pd.DataFrame(results), use_container_width=True)
@@ -0,0 +1,95 @@
+"""
+Stand-in for the Gemini model, for tests, demos and benchmarks without an
+API key. Set MEDISCAN_FAKE_GEMINI=1 to have load_gemini_model() return one.
+
+    FakeModel(latency=0.5, failure_rate=0.1, failure_status=429)
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+
+FAKE_SCAN = {
+    "organ": "Chest",
+    "findings": [
+        {"condition": "Mild infiltration", "severity": "Medium", "box": [250, 200, 550, 600]}
+    ]
+}
+
+FAKE_TEXT = """**Observation:** Simulated review of the reported findings; no model was consulted.
+
+**Severity:** Medium.
+
+**Recommendation:**
+- Correlate clinically
+- Repeat imaging if symptoms persist
+
+**Risk_Percentage:** 40%"""
+
+
+class FakeAPIError(Exception):
+    """Shaped like google.api_core errors: carries an HTTP status in `code`."""
+
+    def __init__(self, code, message="fake API error"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """
+    Deterministic generate_content(): scan JSON when the contents include an
+    image, FAKE_TEXT for plain prompts. Every call sleeps `latency` seconds
+    (plus up to `jitter`) and fails with FakeAPIError(failure_status) with
+    probability `failure_rate`. With stream=True the text arrives word by
+    word, `token_latency` seconds apart.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, failure_status=503,
+                 scan=None, text=FAKE_TEXT, seed=None, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.scan = scan or FAKE_SCAN
+        self.text = text
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        with self._lock:
+            self.calls += 1
+            return self._rng.random(), self._rng.random()
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        fail_roll, jitter_roll = self._roll()
+        time.sleep(self.latency + self.jitter * jitter_roll)
+        if fail_roll < self.failure_rate:
+            raise FakeAPIError(self.failure_status)
+        has_image = isinstance(contents, (list, tuple)) and any(not isinstance(c, str) for c in contents)
+        text = json.dumps(self.scan) if has_image else self.text
+        return self._chunks(text) if stream else FakeResponse(text)
+
+    def _chunks(self, text):
+        for i, word in enumerate(re.findall(r"\S+\s*|\s+", text)):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            yield FakeResponse(word)
+
+
+def from_env():
+    """FakeModel configured by MEDISCAN_FAKE_LATENCY / _TOKEN_LATENCY / _FAILURE_RATE."""
+    return FakeModel(
+        latency=float(os.getenv("MEDISCAN_FAKE_LATENCY", "0")),
+        token_latency=float(os.getenv("MEDISCAN_FAKE_TOKEN_LATENCY", "0")),
+        failure_rate=float(os.getenv("MEDISCAN_FAKE_FAILURE_RATE", "0")),
+    )
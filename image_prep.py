@@ -0,0 +1,175 @@
+"""
+Image preprocessing before inference: downscale to a maximum edge,
+optionally collapse to grayscale, and re-encode as JPEG/WebP. Large exported
+scans then upload and run faster.
+
+Only whole-frame resizes are applied (no crop or padding), so a box on the
+model's 0-1000 scale is the same fraction of the original image as of the
+one sent, and maps back with box_to_pixels(box, original_size).
+
+    python image_prep.py scan1.png scan2.jpg --max-edge 1024 --compare
+"""
+
+import io
+import os
+import time
+from dataclasses import dataclass
+
+from PIL import Image, features
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def _env_flag(name, default):
+    value = os.getenv(name, default).lower()
+    return "auto" if value == "auto" else value in ("1", "true", "yes")
+
+
+@dataclass(frozen=True)
+class PrepConfig:
+    """How images are prepared; part of the scan cache key via signature()."""
+    max_edge: int = 1536
+    fmt: str = "JPEG"
+    quality: int = 85
+    grayscale: object = "auto"  # True, False or "auto" (collapse when R == G == B)
+
+    def signature(self):
+        return f"prep:max_edge={self.max_edge};fmt={self.fmt};q={self.quality};gray={self.grayscale}"
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_edge=int(os.getenv("MEDISCAN_PREP_MAX_EDGE", "1536")),
+            fmt=os.getenv("MEDISCAN_PREP_FORMAT", "JPEG").upper(),
+            quality=int(os.getenv("MEDISCAN_PREP_QUALITY", "85")),
+            grayscale=_env_flag("MEDISCAN_PREP_GRAYSCALE", "auto"),
+        )
+
+
+DEFAULT_PREP = PrepConfig.from_env()
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    size: tuple
+    original_size: tuple
+    original_bytes: int
+    grayscale: bool
+    seconds: float
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - len(self.data)
+
+    @property
+    def blob(self):
+        """Inline image part for model.generate_content."""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+    def summary(self):
+        w, h = self.original_size
+        sw, sh = self.size
+        pct = 100 * self.bytes_saved / self.original_bytes if self.original_bytes else 0
+        return (f"{w}x{h} → {sw}x{sh}{' gray' if self.grayscale else ''}, "
+                f"{self.original_bytes / 1024:.0f} KB → {len(self.data) / 1024:.0f} KB "
+                f"({pct:.0f}% smaller) in {self.seconds * 1000:.0f} ms")
+
+
+def is_grayscale(pil_img, tolerance=2):
+    """True when every channel agrees (an X-ray saved as RGB), judged on a thumbnail."""
+    if pil_img.mode in ("L", "LA", "I", "I;16", "F"):
+        return True
+    thumb = pil_img.convert("RGB")
+    thumb.thumbnail((64, 64))
+    return all(max(r, g, b) - min(r, g, b) <= tolerance for r, g, b in thumb.getdata())
+
+
+def box_to_pixels(box, size):
+    """[ymin, xmin, ymax, xmax] on the 0-1000 scale -> [x0, y0, x1, y1] pixels of an image of `size`."""
+    ymin, xmin, ymax, xmax = box
+    w, h = size
+    return [(xmin / 1000) * w, (ymin / 1000) * h, (xmax / 1000) * w, (ymax / 1000) * h]
+
+
+def prepare_image(image_bytes, config=DEFAULT_PREP, pil_img=None):
+    """
+    Downscaled, re-encoded copy of an image for upload to the model.
+    The original bytes are kept whenever re-encoding wouldn't make them smaller.
+    """
+    start = time.perf_counter()
+    if pil_img is None:
+        pil_img = Image.open(io.BytesIO(image_bytes))
+    original_size = pil_img.size
+    fmt = config.fmt if config.fmt != "WEBP" or features.check("webp") else "JPEG"
+
+    gray = is_grayscale(pil_img) if config.grayscale == "auto" else bool(config.grayscale)
+    img = pil_img.convert("L" if gray else "RGB")
+    if max(img.size) > config.max_edge:
+        scale = config.max_edge / max(img.size)
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+
+    buf = io.BytesIO()
+    img.save(buf, fmt, quality=config.quality)
+    data, mime = buf.getvalue(), MIME_TYPES[fmt]
+    if img.size == original_size and len(data) >= len(image_bytes):
+        source_fmt = (Image.open(io.BytesIO(image_bytes)).format or "").upper()
+        if source_fmt in MIME_TYPES:
+            data, mime = image_bytes, MIME_TYPES[source_fmt]
+
+    return PreparedImage(
+        data=data,
+        mime_type=mime,
+        size=img.size,
+        original_size=original_size,
+        original_bytes=len(image_bytes),
+        grayscale=gray,
+        seconds=time.perf_counter() - start,
+    )
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show what preprocessing saves per image")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--max-edge", type=int, default=DEFAULT_PREP.max_edge)
+    parser.add_argument("--format", default=DEFAULT_PREP.fmt, choices=["JPEG", "WEBP"])
+    parser.add_argument("--quality", type=int, default=DEFAULT_PREP.quality)
+    parser.add_argument("--grayscale", default=str(DEFAULT_PREP.grayscale), choices=["auto", "True", "False"])
+    parser.add_argument("--compare", action="store_true",
+                        help="also time one model call with the raw and the prepared image")
+    args = parser.parse_args(argv)
+    gray = "auto" if args.grayscale == "auto" else args.grayscale == "True"
+    config = PrepConfig(args.max_edge, args.format.upper(), args.quality, gray)
+
+    model = None
+    if args.compare:
+        from scan_pipeline import SCAN_PROMPT, load_gemini_model
+        model = load_gemini_model()
+        if model is None:
+            parser.error("--compare needs GEMINI_API_KEY (or MEDISCAN_FAKE_GEMINI=1)")
+
+    total_in = total_out = 0
+    for path in args.images:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        prepared = prepare_image(raw, config)
+        total_in += prepared.original_bytes
+        total_out += len(prepared.data)
+        line = f"{path}: {prepared.summary()}"
+        if model is not None:
+            timings = []
+            for part in (Image.open(io.BytesIO(raw)).convert("RGB"), prepared.blob):
+                t = time.perf_counter()
+                model.generate_content([SCAN_PROMPT, part])
+                timings.append(time.perf_counter() - t)
+            line += f"; inference {timings[0]:.2f}s raw vs {timings[1]:.2f}s prepared"
+        print(line)
+    if total_in:
+        print(f"total: {total_in / 1024:.0f} KB → {total_out / 1024:.0f} KB, saved {(total_in - total_out) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Persistent, content-addressed cache for Gemini results.
+
+Entries live in a small SQLite file so every session and process on the
+host shares them. Keys are SHA-256 digests of everything that determines the
+answer (model version, prompt, image bytes); entries expire after a TTL and
+the least recently used ones are evicted once a namespace grows past
+`max_entries`.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_FILE = os.getenv("MEDISCAN_INFERENCE_CACHE", "inference_cache.db")
+
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_TTL = 7 * 24 * 3600  # seconds
+
+
+def make_key(*parts):
+    """SHA-256 over the given parts (bytes or str), unambiguous about part boundaries."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def normalize_prompt(text):
+    """Collapses whitespace so prompts that differ only in layout share a cache entry."""
+    return re.sub(r"\s+", " ", str(text)).strip()
+
+
+class InferenceCache:
+    """Size-bounded LRU + TTL cache of JSON-serialisable results, shared across processes."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS results (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        created REAL NOT NULL,
+        accessed REAL NOT NULL,
+        PRIMARY KEY (namespace, key)
+    );
+    CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (namespace, accessed);
+    """
+
+    def __init__(self, path=CACHE_FILE, namespace="scan", max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        """Cached value for `key`, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created FROM results WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            with conn:
+                conn.execute(
+                    "UPDATE results SET accessed = ? WHERE namespace = ? AND key = ?",
+                    (now, self.namespace, key),
+                )
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value), now, now),
+                )
+                conn.execute(
+                    "DELETE FROM results WHERE namespace = ? AND created < ?",
+                    (self.namespace, now - self.ttl),
+                )
+                conn.execute(
+                    """DELETE FROM results WHERE namespace = ? AND key IN (
+                           SELECT key FROM results WHERE namespace = ?
+                           ORDER BY accessed DESC LIMIT -1 OFFSET ?)""",
+                    (self.namespace, self.namespace, self.max_entries),
+                )
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM results WHERE namespace = ?", (self.namespace,))
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COUNT(*) FROM results WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+
+
+def generate_text(model, prompt, model_version, cache=None, use_cache=True):
+    """
+    model.generate_content(prompt).text, memoized on (model_version, normalized prompt).
+    Returns (text, from_cache). Pass use_cache=False to force a fresh
+    generation; its result still refreshes the cache entry.
+    """
+    key = make_key(model_version, normalize_prompt(prompt))
+    if cache is not None and use_cache:
+        text = cache.get(key)
+        if text is not None:
+            return text, True
+    text = model.generate_content(prompt).text
+    if cache is not None:
+        cache.put(key, text)
+    return text, False
+
+
+def stream_text(model, prompt, model_version, cache=None, use_cache=True):
+    """
+    Streaming counterpart of generate_text. Returns (chunks, from_cache):
+    a cached text comes back as a single chunk; otherwise chunks come from
+    model.stream() when the model has one, and the full text is cached once
+    the stream completes.
+    """
+    key = make_key(model_version, normalize_prompt(prompt))
+    if cache is not None and use_cache:
+        text = cache.get(key)
+        if text is not None:
+            return iter([text]), True
+
+    def chunks():
+        if not hasattr(model, "stream"):
+            # The cache was already checked above; generate_text refreshes it
+            text, _ = generate_text(model, prompt, model_version, cache, use_cache=False)
+            yield text
+            return
+        parts = []
+        for part in model.stream(prompt):
+            parts.append(part)
+            yield part
+        if cache is not None:
+            cache.put(key, "".join(parts))
+
+    return chunks(), False
@@ -0,0 +1,255 @@
+"""
+Resilient wrapper around the Gemini model.
+
+InferenceClient exposes the same generate_content() as the SDK model, so
+scan_pipeline and inference_cache can use either one. Each call gets:
+
+- a deadline covering every attempt and the backoff between them, started
+  once the call holds one of the client's slots (waiting for a slot is
+  bounded by the same timeout but is not held against the service);
+- retries with exponential backoff and jitter on 429 / 5xx / timeouts;
+- a bound on how many model calls run at once;
+- a circuit breaker. After `breaker_threshold` consecutive failures, calls
+  fail fast with CircuitOpenError for `breaker_reset` seconds. Callers check
+  `available` and drop to simulation mode until a trial call succeeds.
+
+submit() and agenerate() give the threaded and asyncio flavours of the call;
+stream() yields the text as it is generated.
+Tests can pass fake_gemini.FakeModel as the model.
+"""
+
+import asyncio
+import inspect
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+DEFAULT_TIMEOUT = float(os.getenv("MEDISCAN_INFERENCE_TIMEOUT", "60"))  # seconds per call
+DEFAULT_MAX_RETRIES = int(os.getenv("MEDISCAN_INFERENCE_RETRIES", "3"))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("MEDISCAN_INFERENCE_CONCURRENCY", "4"))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class InferenceError(Exception):
+    """A model call failed for good (retries exhausted or not retryable)."""
+
+
+class DeadlineExceeded(InferenceError):
+    pass
+
+
+class CircuitOpenError(InferenceError):
+    """The breaker is open; the caller should fall back to simulation."""
+
+
+def status_code(exc):
+    """HTTP-style status of an API error, if it carries one."""
+    for attr in ("code", "status_code"):
+        code = getattr(exc, attr, None)
+        if callable(code):
+            # grpc errors expose code() returning an enum
+            try:
+                code = code()
+            except Exception:
+                code = None
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def is_retryable(exc):
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying."""
+    if isinstance(exc, (TimeoutError, FutureTimeout, ConnectionError)):
+        return True
+    return status_code(exc) in RETRYABLE_STATUS
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; lets one trial call through after `reset_after` seconds."""
+
+    def __init__(self, threshold=5, reset_after=60.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_after or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class InferenceClient:
+    """Deadline/retry/backoff/concurrency/circuit-breaker policy around a model."""
+
+    def __init__(self, model, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff=1.0, max_backoff=30.0, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 breaker_threshold=5, breaker_reset=60.0):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.calls = 0
+        self.retries = 0
+        # A model call holds a slot until it returns, so at most
+        # max_concurrency are in flight; a call abandoned at its deadline
+        # keeps its slot (and worker) until then.
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._calls = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="inference")
+        self._dispatch = ThreadPoolExecutor(max_workers=max(8, 2 * max_concurrency), thread_name_prefix="inference-dispatch")
+
+    @property
+    def available(self):
+        """False while the breaker is open: use simulation mode instead."""
+        return self.model is not None and self.breaker.state != "open"
+
+    def _delay(self, attempt):
+        # Full jitter keeps parallel callers from retrying in lockstep
+        return random.uniform(0.5, 1.0) * min(self.max_backoff, self.backoff * 2 ** attempt)
+
+    def _run(self, contents, kwargs):
+        try:
+            return self.model.generate_content(contents, **kwargs)
+        finally:
+            self._slots.release()
+
+    def _acquire_slot(self, wait):
+        """Waits up to `wait` seconds for a free slot. Time spent here is our own queue, not the service's fault."""
+        if not self._slots.acquire(timeout=max(wait, 0)):
+            raise DeadlineExceeded(f"no free model slot within {wait:g}s")
+
+    def generate_content(self, contents, timeout=None, **kwargs):
+        """model.generate_content(contents) under the client's policy; returns the response."""
+        if self.model is None:
+            raise CircuitOpenError("no model configured")
+        if self.breaker.state == "open":
+            raise CircuitOpenError("model unavailable, circuit breaker open")
+        timeout = timeout or self.timeout
+        self._acquire_slot(timeout)
+        # Only claim the half-open trial once this call can actually run
+        if not self.breaker.allow():
+            self._slots.release()
+            raise CircuitOpenError("model unavailable, circuit breaker open")
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            if attempt:
+                self._acquire_slot(deadline - time.monotonic())
+            self.calls += 1
+            try:
+                future = self._calls.submit(self._run, contents, kwargs)
+            except BaseException:
+                self._slots.release()
+                raise
+            try:
+                try:
+                    response = future.result(timeout=max(deadline - time.monotonic(), 0))
+                except FutureTimeout:
+                    if future.cancel():
+                        # Never started, so _run will not release its slot
+                        self._slots.release()
+                    raise DeadlineExceeded(f"model call exceeded {timeout:g}s deadline")
+            except Exception as e:
+                retryable = isinstance(e, DeadlineExceeded) or is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # The service answered; it just didn't like this request
+                    self.breaker.record_success()
+                if isinstance(e, DeadlineExceeded):
+                    raise
+                delay = self._delay(attempt)
+                if not retryable or attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    raise InferenceError(f"{type(e).__name__}: {e}") from e
+                if self.breaker.state == "open":
+                    raise CircuitOpenError(f"circuit breaker opened: {type(e).__name__}: {e}") from e
+                attempt += 1
+                self.retries += 1
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return response
+
+    def generate(self, contents, timeout=None):
+        """Text of the response."""
+        return self.generate_content(contents, timeout=timeout).text
+
+    @property
+    def supports_streaming(self):
+        try:
+            params = inspect.signature(self.model.generate_content).parameters
+        except (TypeError, ValueError):
+            return False
+        return "stream" in params
+
+    def stream(self, contents, timeout=None):
+        """
+        Yields the response text in chunks as the model produces them.
+        Retries apply until the stream opens; a failure after the first
+        chunk raises InferenceError. Models without streaming yield the
+        whole text as one chunk.
+        """
+        if not self.supports_streaming:
+            yield self.generate(contents, timeout=timeout)
+            return
+        response = self.generate_content(contents, timeout=timeout, stream=True)
+        # Reading the stream gets its own deadline, from when it opened
+        deadline = time.monotonic() + (timeout or self.timeout)
+        try:
+            for chunk in response:
+                text = getattr(chunk, "text", "")
+                if text:
+                    yield text
+                if time.monotonic() > deadline:
+                    raise DeadlineExceeded(f"stream exceeded {timeout or self.timeout:g}s deadline")
+        except InferenceError:
+            self.breaker.record_failure()
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+            raise InferenceError(f"stream interrupted: {type(e).__name__}: {e}") from e
+
+    def submit(self, contents, timeout=None):
+        """Starts generate() in the background and returns a concurrent.futures.Future."""
+        return self._dispatch.submit(self.generate, contents, timeout)
+
+    async def agenerate(self, contents, timeout=None):
+        return await asyncio.wrap_future(self.submit(contents, timeout))
+
+    def close(self):
+        self._dispatch.shutdown(wait=False, cancel_futures=True)
+        self._calls.shutdown(wait=False, cancel_futures=True)
@@ -1,11 +1,8 @@
-import os
-import os
 import json
 import random
 import re
 import pandas as pd
 import streamlit as st
-from PIL import Image, ImageDraw
 
 # NEW: Import dotenv to read .env file
 try:
@@ -16,11 +13,21 @@ except ImportError:
 
 # --- Custom Module Imports ---
 from patient_db import (
-    make_patient_entry, add_record, load_all, 
-    find_by_id, search, update_record, delete_record
+    add_record,
+    find_by_id, search, update_record, delete_record,
+    by_specialization, filter_records, count, StaleRecordError,
+    next_patient_id, STATUSES, get_stats, recent_critical, generation
 )
 from pdf_gen import create_medical_pdf
-from utils import sanitize_text, timestamp_now, simulate_progress_bar
+from utils import timestamp_now, StageProgress, format_age, format_sex
+from severity import SEVERITY_LEVELS, classify_series
+from inference_cache import InferenceCache, make_key, stream_text
+from scan_pipeline import (
+    GEMINI_MODEL_VERSION, SCAN_STAGES, load_gemini_model, analyze_image,
+    ScanImages, specialization_for, build_record, narrative_prompt
+)
+from batch_scan import run_batch, collect_uploads
+from inference_client import InferenceClient, CircuitOpenError
 
 # --- Configuration ---
 st.set_page_config(
@@ -30,90 +37,52 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# You can change this string to "gemini-2.0-flash-exp" or "gemini-3.0-flash" as they become available
-GEMINI_MODEL_VERSION = "gemini-2.5-flash-lite"
-
 # --- Gemini Setup ---
-GEMINI_AVAILABLE = False
-GEMINI_MODEL = None
-
-try:
-    import google.generativeai as genai
-    # Attempt to get key from environment, but don't crash if missing
-    API_KEY = os.getenv("GEMINI_API_KEY") 
-    if API_KEY:
-        genai.configure(api_key=API_KEY)
-        GEMINI_MODEL = genai.GenerativeModel(GEMINI_MODEL_VERSION)
-        GEMINI_AVAILABLE = True
-except ImportError:
-    pass
+# The model version lives in scan_pipeline.GEMINI_MODEL_VERSION
+GEMINI_MODEL = load_gemini_model()
+GEMINI_AVAILABLE = GEMINI_MODEL is not None
+
+@st.cache_resource
+def get_inference_client():
+    """Timeouts, retries and the circuit breaker for every model call, shared by all sessions."""
+    return InferenceClient(GEMINI_MODEL)
+
+def live_model():
+    """The model to call right now, or None to use simulation mode (no key, or breaker open)."""
+    client = get_inference_client()
+    return client if client.available else None
+
+@st.cache_resource
+def get_scan_cache():
+    """Scan results keyed on image bytes + prompt + model, shared by every session."""
+    return InferenceCache(namespace="scan")
+
+@st.cache_resource
+def get_text_cache():
+    """Narrative/chat generations keyed on normalized prompt + model, shared by every session."""
+    return InferenceCache(namespace="text", max_entries=1000)
+
+def count_cache_result(from_cache):
+    st.session_state.cache_stats["hits" if from_cache else "misses"] += 1
+
+def scan_images_for(uploaded_file):
+    """Decoded/annotated/encoded images of this upload, reused across reruns until the file changes."""
+    data = uploaded_file.getvalue()
+    digest = make_key(data)
+    images = st.session_state.get("scan_images")
+    if images is None or images.digest != digest:
+        images = st.session_state.scan_images = ScanImages(data, digest)
+    return images
+
+def render_stream(chunks):
+    """Shows text chunks as they arrive and returns the full text (all at once on Streamlit without write_stream)."""
+    if hasattr(st, "write_stream"):
+        return st.write_stream(chunks)
+    text = "".join(chunks)
+    st.markdown(text)
+    return text
 
 # --- Constants & Mappings ---
-ORGAN_SPECIALIZATION_MAP = {
-    # Cardiovascular
-    "heart": "cardiologist",
-
-    # Respiratory
-    "lungs": "pulmonologist",
-    "lung": "pulmonologist",
-    "chest": "pulmonologist",
-
-    # Bones & Joints (Orthopedic)
-    "bone": "orthopedist",
-    "hand": "orthopedist",
-    "wrist": "orthopedist",
-    "forearm": "orthopedist",
-    "elbow": "orthopedist",
-    "shoulder": "orthopedist",
-    "knee": "orthopedist",
-    "leg": "orthopedist",
-    "ankle": "orthopedist",
-    "foot": "orthopedist",
-    "spine": "orthopedist",
-    "ribs": "orthopedist",
-
-    # Neurological
-    "brain": "neurologist",
-    "skull": "neurologist",
-    "head": "neurologist",
-    "nerves": "neurologist",
-    "cancer": "oncologist",
-
-    # Gastrointestinal
-    "stomach": "gastroenterologist",
-    "abdomen": "gastroenterologist",
-    "liver": "hepatologist",
-    "intestine": "gastroenterologist",
-
-    # ENT
-    "ear": "ent specialist",
-    "nose": "ent specialist",
-    "throat": "ent specialist",
-    "sinus": "ent specialist",
-
-    # Eyes
-    "eye": "ophthalmologist",
-    "vision": "ophthalmologist",
-
-    # Skin
-    "skin": "dermatologist",
-    "hair": "dermatologist",
-    "nails": "dermatologist",
-    "rashes": "dermatologist",
-
-    # Urinary & Kidneys
-    "kidney": "nephrologist",
-    "urine": "urologist",
-    "bladder": "urologist",
-
-    # Reproductive
-    "ovary": "gynecologist",
-    "uterus": "gynecologist",
-    "testicles": "urologist",
-    "prostate": "urologist"
-}
-
-
 DOCTOR_CREDENTIALS = {
     "general": {"u": "doc", "p": "123"}, # Simplified for demo
     "cardiologist": {"u": "cardio", "p": "123"},
@@ -191,23 +160,9 @@ CSS = """
 st.markdown(CSS, unsafe_allow_html=True)
 
 # --- Session State Initialization ---
-if "patient_counter" not in st.session_state:
-    # Get the highest patient ID from existing records
-    existing_records = load_all()
-    if existing_records:
-        max_id = 0
-        for rec in existing_records:
-            pid = rec.get('id', 'PID-0')
-            try:
-                num = int(pid.split('-')[1])
-                max_id = max(max_id, num)
-            except:
-                pass
-        st.session_state.patient_counter = max_id + 1
-    else:
-        st.session_state.patient_counter = 1000
 if "report_id" not in st.session_state:
-    st.session_state.report_id = f"PID-{st.session_state.patient_counter}"
+    # Allocated from the registry's shared sequence, unique across sessions
+    st.session_state.report_id = next_patient_id()
 if "last_uploaded_file" not in st.session_state:
     st.session_state.last_uploaded_file = None
 if "analysis_result" not in st.session_state:
@@ -220,6 +175,8 @@ if "doctor_specialization" not in st.session_state:
     st.session_state.doctor_specialization = None
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "cache_stats" not in st.session_state:
+    st.session_state.cache_stats = {"hits": 0, "misses": 0}
 
 # --- SIDEBAR (Navigation & Context) ---
 with st.sidebar:
@@ -238,16 +195,23 @@ with st.sidebar:
     st.info(f"**Current Session:** {st.session_state.report_id}")
     
     if st.button("New Patient Session", use_container_width=True):
-        st.session_state.patient_counter += 1
-        st.session_state.report_id = f"PID-{st.session_state.patient_counter}"
+        st.session_state.report_id = next_patient_id()
         st.session_state.analysis_result = None
         st.session_state.deep_eval_result = None
         st.session_state.chat_history = []
         st.session_state.last_uploaded_file = None
+        st.session_state.scan_images = None
+        st.session_state.report_pdf = None
         st.rerun()
 
     st.markdown("---")
-    st.caption(f"System Status: {'🟢 Online' if GEMINI_AVAILABLE else '🟠 Offline (Simulation Mode)'}")
+    if not GEMINI_AVAILABLE:
+        st.caption("System Status: 🟠 Offline (Simulation Mode)")
+    elif live_model() is None:
+        st.caption("System Status: 🔴 AI service unreachable, using Simulation Mode until it recovers")
+    else:
+        st.caption("System Status: 🟢 Online")
+    st.caption(f"Result Cache: {st.session_state.cache_stats['hits']} hits · {st.session_state.cache_stats['misses']} misses")
 
 # --- MAIN CONTENT ---
 
@@ -300,63 +264,109 @@ with tab1:
             
             if st.button("🚀 Run Diagnostic Scan", use_container_width=True):
                 with st.status("Initializing MediScan Engine...", expanded=True) as status:
-                    st.write("Preprocessing image...")
-                    pil_img = Image.open(uploaded_file).convert("RGB")
-                    
-                    st.write("Analyzing patterns...")
-                    simulate_progress_bar(st, "Scanning pixels...", speed=0.02)
+                    images = scan_images_for(uploaded_file)
                     
                     # --- AI LOGIC OR MOCK FALLBACK ---
-                    if GEMINI_AVAILABLE and GEMINI_MODEL:
-                        try:
-                            prompt = """
-                            Analyze this medical image. Return JSON ONLY:
-                            {"organ":"Name","findings":[{"condition":"Name","severity":"Low/Med/High","box":[ymin,xmin,ymax,xmax]}]}
-                            Coordinates 0-1000 scale.
-                            """
-                            resp = GEMINI_MODEL.generate_content([prompt, pil_img])
-                            txt = sanitize_text(resp.text)
-                            res = json.loads(txt)
-                        except Exception as e:
-                            st.error(f"AI Error: {e}")
-                            res = None
-                    else:
-                        # Simulation fallback
-                        res = {
-                            "organ": "Lungs", 
-                            "findings": [
-                                {"condition": "Opacification", "severity": "High", "box": [200, 300, 600, 700]}
-                            ]
-                        }
+                    model = live_model()
+                    try:
+                        # The bar moves as each stage actually finishes; no artificial delay
+                        scan_info = {}
+                        with StageProgress(st, SCAN_STAGES + ("annotate",), text="Analyzing patterns...") as progress:
+                            # Byte-identical image + same prompt + same model => same answer
+                            res, from_cache = analyze_image(model, images.data, images.image, cache=get_scan_cache(),
+                                                            on_stage=progress, info=scan_info)
+                            # Boxes are drawn here, as in bench_pipeline; the preview reuses the cached JPEG
+                            with progress.stage("annotate"):
+                                images.jpeg(res)
+                        if model is not None:
+                            count_cache_result(from_cache)
+                        if from_cache:
+                            st.write("⚡ Cache hit: reusing the earlier analysis of this exact image")
+                        else:
+                            if "prepared" in scan_info:
+                                st.write(f"Preprocessed: {scan_info['prepared'].summary()}")
+                            st.write(" · ".join(f"{stage} {secs * 1000:.0f} ms" for stage, secs in progress.timings.items()))
+                    except CircuitOpenError:
+                        st.warning("⚠️ AI service unreachable: showing a simulated analysis")
+                        res, _ = analyze_image(None, images.data)
+                    except Exception as e:
+                        st.error(f"AI Error: {e}")
+                        res = None
                     
                     st.session_state.analysis_result = res
                     status.update(label="Scan Complete", state="complete", expanded=False)
+        
+        with st.expander("📦 Batch Scan (multiple images / ZIP)"):
+            batch_files = st.file_uploader(
+                "Drop several scans or a ZIP archive", type=["jpg", "png", "jpeg", "zip"],
+                accept_multiple_files=True, key="batch_files"
+            )
+            b_col1, b_col2 = st.columns(2)
+            batch_workers = b_col1.slider("Parallel scans", 1, 16, 4, key="batch_workers")
+            batch_rate = b_col2.number_input("Max calls/sec (0 = unlimited)", 0.0, 50.0, 0.0, step=0.5, key="batch_rate")
+            batch_simulated = live_model() is None
+            # Simulated scans give every film the same canned diagnosis; keep them out of the registry
+            batch_save = st.checkbox("Save results to registry", value=not batch_simulated,
+                                     disabled=batch_simulated, key="batch_save") and not batch_simulated
+            if batch_simulated:
+                st.caption("AI service unavailable: batch results are simulated and will not be saved.")
+            st.caption("Patient names are taken from the file names; edit them later in the Doctor Portal.")
+            
+            if batch_files and st.button("🚀 Run Batch Scan", use_container_width=True):
+                progress = st.progress(0.0, text="Starting batch...")
+                
+                def on_batch_progress(done, total, item):
+                    progress.progress(done / total, text=f"Scanned {done}/{total}: {item.name}")
+                    if batch_model is not None and item.ok:
+                        count_cache_result(item.from_cache)
+                
+                # A client of its own sized to the slider, as the CLI does: the shared
+                # one has DEFAULT_MAX_CONCURRENCY slots, which a batch would fill,
+                # queueing its own scans and every other session's behind them
+                batch_model = InferenceClient(GEMINI_MODEL, max_concurrency=batch_workers) if live_model() is not None else None
+                try:
+                    batch_items = run_batch(
+                        collect_uploads(batch_files),
+                        model=batch_model,
+                        cache=get_scan_cache(),
+                        workers=batch_workers,
+                        rate=batch_rate or None,
+                        save=batch_save,
+                        on_progress=on_batch_progress,
+                    )
+                finally:
+                    if batch_model is not None:
+                        batch_model.close()
+                st.session_state.batch_results = [
+                    {
+                        "File": item.name,
+                        "Patient ID": item.patient_id or "not saved",
+                        "Organ": (item.result or {}).get("organ"),
+                        "Condition": item.record["disease"] if item.ok else None,
+                        "Department": item.record["specialization"] if item.ok else None,
+                        "Cached": item.from_cache,
+                        "Seconds": round(item.seconds, 2),
+                        "Error": item.error,
+                    }
+                    for item in batch_items
+                ]
+                failed = sum(1 for item in batch_items if not item.ok)
+                progress.progress(1.0, text=f"Batch complete: {len(batch_items) - failed} scanned, {failed} failed")
+            
+            if st.session_state.get("batch_results"):
+                st.dataframe(pd.DataFrame(st.session_state.batch_results), use_container_width=True, hide_index=True)
     
     with col_preview:
         if uploaded_file:
-            pil_img = Image.open(uploaded_file).convert("RGB")
+            # Decoding, annotation and JPEG encoding happen once per upload/result, not per rerun
+            images = scan_images_for(uploaded_file)
+            result = st.session_state.analysis_result
             
             # If we have results, draw boxes
-            if st.session_state.analysis_result:
-                # Create a copy for annotation
-                annotated_img = pil_img.copy()
-                draw = ImageDraw.Draw(annotated_img)
-                w, h = annotated_img.size
-                
-                for f in st.session_state.analysis_result.get("findings", []):
-                    if "box" in f:
-                        ymin, xmin, ymax, xmax = f["box"]
-                        # Scale 1000 to image size
-                        box = [(xmin/1000)*w, (ymin/1000)*h, (xmax/1000)*w, (ymax/1000)*h]
-                        draw.rectangle(box, outline="#ef4444", width=5)
-                
-                # Save annotated image for PDF
-                annotated_img.save("temp_scan.jpg")
-                st.image(annotated_img, caption="AI Annotated Analysis", use_container_width=True)
+            if result:
+                st.image(images.jpeg(result), caption="AI Annotated Analysis", use_container_width=True)
             else:
-                # Save original for PDF if no analysis yet
-                pil_img.save("temp_scan.jpg")
-                st.image(pil_img, caption="Original Source", use_container_width=True)
+                st.image(images.data, caption="Original Source", use_container_width=True)
         else:
             st.info("Awaiting Image Upload")
 
@@ -371,35 +381,28 @@ with tab2:
             st.subheader("Deep Clinical Analysis")
             
             if not st.session_state.deep_eval_result:
+                fresh_narrative = st.checkbox("Bypass cache (force a fresh narrative)", key="narrative_fresh")
                 if st.button("⚡ Generate Clinical Narrative"):
-                    with st.spinner("Synthesizing medical literature..."):
-                        if GEMINI_AVAILABLE and GEMINI_MODEL:
-                            try:
-                                # Real AI Call with detailed medical analysis prompt
-                                organ = st.session_state.analysis_result.get('organ', 'Unknown')
-                                findings = st.session_state.analysis_result.get('findings', [])
-                                findings_text = ", ".join([f"{f.get('condition')} ({f.get('severity')} severity)" for f in findings])
-                                
-                                prompt = f"""You are a medical AI assistant. Analyze this diagnostic scan and provide a detailed clinical report.
-
-Scan Details:
-- Target Organ: {organ}
-- Detected Conditions: {findings_text}
-
-Provide a structured clinical analysis with the following sections:
-1. Observation: Detailed description of what is seen in the scan
-2. Severity: Assessment of the condition severity (Low/Medium/High)
-3. Recommendation: Specific medical recommendations and next steps
-4. Risk_Percentage: Estimated risk percentage (0-100)
-
-Format your response with clear section headers."""
-                                
-                                resp = GEMINI_MODEL.generate_content(prompt)
-                                st.session_state.deep_eval_result = resp.text
-                            except Exception as e:
-                                st.error(f"AI Error: {e}")
-                                # Fallback to mock
-                                st.session_state.deep_eval_result = """
+                    model = live_model()
+                    if model:
+                        try:
+                            # Real AI Call with detailed medical analysis prompt
+                            prompt = narrative_prompt(st.session_state.analysis_result)
+                            
+                            # Identical findings => identical prompt => reuse the earlier narrative
+                            chunks, from_cache = stream_text(
+                                model, prompt, GEMINI_MODEL_VERSION,
+                                cache=get_text_cache(), use_cache=not fresh_narrative
+                            )
+                            count_cache_result(from_cache)
+                            if from_cache:
+                                st.toast("⚡ Narrative served from cache")
+                            # Rendered as it is generated; the full text is kept for the PDF and chat
+                            st.session_state.deep_eval_result = render_stream(chunks)
+                        except Exception as e:
+                            st.error(f"AI Error: {e}")
+                            # Fallback to mock
+                            st.session_state.deep_eval_result = """
 **Observation:** The scan demonstrates a localized region of increased density in the lower lobe, suggestive of consolidation.
 
 **Severity:** Moderate to High. Requires clinical correlation.
@@ -410,11 +413,10 @@ Format your response with clear section headers."""
 - Pulmonology consultation
 
 **Risk_Percentage:** 78%
-                                """
-                        else:
-                            # Mock
-                            simulate_progress_bar(st, "Thinking...", speed=0.03)
-                            st.session_state.deep_eval_result = """
+                            """
+                    else:
+                        # Mock
+                        st.session_state.deep_eval_result = """
 **Observation:** The scan demonstrates a localized region of increased density in the lower lobe, suggestive of consolidation.
 
 **Severity:** Moderate to High. Requires clinical correlation.
@@ -425,8 +427,8 @@ Format your response with clear section headers."""
 - Pulmonology consultation
 
 **Risk_Percentage:** 78%
-                            """
-                        st.rerun()
+                        """
+                    st.rerun()
             
             if st.session_state.deep_eval_result:
                 st.markdown(st.session_state.deep_eval_result)
@@ -438,45 +440,54 @@ Format your response with clear section headers."""
                 
                 # Auto-detect specialization based on organ
                 detected_organ = st.session_state.analysis_result.get("organ", "").lower()
-                auto_spec = ORGAN_SPECIALIZATION_MAP.get(detected_organ, "general")
+                auto_spec = specialization_for(st.session_state.analysis_result)
                 
                 st.success(f"🎯 Auto-assigned Department: **{auto_spec.capitalize()}**")
                 st.caption(f"Based on detected organ: {detected_organ.capitalize() if detected_organ else 'Unknown'}")
                 
                 if st.button("💾 Save Record", use_container_width=True):
-                    # Safely handle empty findings list
-                    findings_list = st.session_state.analysis_result.get("findings", [])
-                    disease = findings_list[0].get("condition", "Unknown") if findings_list else "Unknown"
-                    
-                    # Use auto-assigned specialization
-                    rec = make_patient_entry(p_name, p_age, p_sex, st.session_state.report_id, disease, auto_spec)
+                    rec = build_record(p_name, p_age, p_sex, st.session_state.report_id, st.session_state.analysis_result,
+                                       narrative=st.session_state.deep_eval_result)
                     add_record(rec)
                     
-                    # Increment patient counter for next patient
-                    st.session_state.patient_counter += 1
-                    
                     st.toast(f"✅ Record {rec['id']} saved to {auto_spec.upper()} department!", icon="✅")
                     st.balloons()
 
             st.write("")
-            if os.path.exists("temp_scan.jpg"):
-                pdf_data = create_medical_pdf(
-                    {"name": p_name, "age": p_age, "sex": p_sex, "id": st.session_state.report_id, "date": timestamp_now()},
-                    st.session_state.analysis_result,
-                    st.session_state.deep_eval_result,
-                    image_path="temp_scan.jpg"
-                )
-                st.download_button(
-                    label="📄 Download PDF Report",
-                    data=pdf_data,
-                    file_name=f"Report_{st.session_state.report_id}.pdf",
-                    mime="application/pdf",
-                    use_container_width=True
+            # Scan images live in this session only; nothing is written to disk
+            scan_images = st.session_state.get("scan_images")
+            if scan_images is not None:
+                # The PDF is rendered only on request and reused until its inputs change
+                report_patient = {"name": p_name, "age": p_age, "sex": p_sex, "id": st.session_state.report_id}
+                pdf_key = make_key(
+                    json.dumps([report_patient, st.session_state.analysis_result, st.session_state.deep_eval_result],
+                               sort_keys=True, default=str),
+                    scan_images.digest
                 )
+                cached_pdf = st.session_state.get("report_pdf")
+                if cached_pdf and cached_pdf[0] == pdf_key:
+                    st.download_button(
+                        label="📄 Download PDF Report",
+                        data=cached_pdf[1],
+                        file_name=f"Report_{st.session_state.report_id}.pdf",
+                        mime="application/pdf",
+                        use_container_width=True
+                    )
+                elif st.button("📄 Prepare PDF Report", use_container_width=True):
+                    with st.spinner("Rendering report..."):
+                        pdf_data = create_medical_pdf(
+                            {**report_patient, "date": timestamp_now()},
+                            st.session_state.analysis_result,
+                            st.session_state.deep_eval_result,
+                            image=scan_images.jpeg(st.session_state.analysis_result)
+                        )
+                    st.session_state.report_pdf = (pdf_key, pdf_data)
+                    st.rerun()
 
 # --- TAB 3: DOCTOR AI ASSISTANT ---
 with tab3:
     st.subheader("AI Consultant")
+    st.toggle("Bypass answer cache", key="chat_fresh", help="Ask the model again even if this exact question was answered before")
     
     # Render chat history
     for msg in st.session_state.chat_history:
@@ -491,19 +502,26 @@ with tab3:
 
         # AI Response
         with st.chat_message("assistant"):
-            with st.spinner("Consulting medical database..."):
-                response_text = "I recommend further testing to confirm the diagnosis." # Default
-                
-                if GEMINI_AVAILABLE and GEMINI_MODEL and st.session_state.deep_eval_result:
-                    try:
-                        ctx = f"Context: {st.session_state.deep_eval_result}\nUser: {prompt}"
-                        resp = GEMINI_MODEL.generate_content(ctx)
-                        response_text = resp.text
-                    except:
-                        pass
-                
+            response_text = "I recommend further testing to confirm the diagnosis." # Default
+            
+            model = live_model()
+            if model and st.session_state.deep_eval_result:
+                try:
+                    ctx = f"Context: {st.session_state.deep_eval_result}\nUser: {prompt}"
+                    chunks, from_cache = stream_text(
+                        model, ctx, GEMINI_MODEL_VERSION,
+                        cache=get_text_cache(), use_cache=not st.session_state.get("chat_fresh", False)
+                    )
+                    count_cache_result(from_cache)
+                    response_text = render_stream(chunks)
+                    if from_cache:
+                        st.caption("⚡ Answer served from cache")
+                except Exception as e:
+                    st.caption(f"⚠️ AI consultant unavailable ({e}); showing default guidance")
+                    st.markdown(response_text)
+            else:
                 st.markdown(response_text)
-                st.session_state.chat_history.append({"role": "assistant", "content": response_text})
+            st.session_state.chat_history.append({"role": "assistant", "content": response_text})
 
 # --- TAB 4: DOCTOR PORTAL ---
 with tab4:
@@ -550,20 +568,20 @@ with tab4:
         
         st.divider()
         
-        # Load records for this department only
-        all_records = load_all()
-        dept_records = [r for r in all_records if r.get('specialization', '').lower() == st.session_state.doctor_specialization.lower()]
+        # Department totals come straight from the patient_db indexes
+        dept = st.session_state.doctor_specialization
+        total_patients = count(dept)
         
-        if dept_records:
+        if total_patients:
             # Summary metrics for department
             metric_col1, metric_col2, metric_col3 = st.columns(3)
             with metric_col1:
-                st.metric("Total Patients", len(dept_records))
+                st.metric("Total Patients", total_patients)
             with metric_col2:
-                pending_count = sum(1 for r in dept_records if r.get('status') == 'Pending Review')
+                pending_count = count(dept, 'Pending Review')
                 st.metric("Pending Reviews", pending_count)
             with metric_col3:
-                reviewed_count = sum(1 for r in dept_records if r.get('status') == 'Reviewed')
+                reviewed_count = count(dept, 'Reviewed')
                 st.metric("Reviewed", reviewed_count)
             
             st.divider()
@@ -571,57 +589,121 @@ with tab4:
             # Patient list and editing
             st.markdown("### 📋 Patient Records")
             
-            # Initialize edit mode in session state
+            # Initialize open/edit state in session state
+            if "open_patient" not in st.session_state:
+                st.session_state.open_patient = None
             if "editing_patient" not in st.session_state:
                 st.session_state.editing_patient = None
+            # Version of the record when Edit was clicked; a save checks it
+            # against the stored one so another clinician's edit is not overwritten
+            if "editing_version" not in st.session_state:
+                st.session_state.editing_version = None
+            
+            # List controls: only one page of records is fetched and rendered
+            SORT_OPTIONS = {
+                "Newest first": {"sort_by": "date", "newest_first": True},
+                "Oldest first": {"sort_by": "date", "newest_first": False},
+                "Status": {"sort_by": "status", "newest_first": True},
+            }
+            ctrl_col1, ctrl_col2, ctrl_col3, ctrl_col4 = st.columns([2, 2, 1, 1])
+            with ctrl_col1:
+                sort_choice = st.selectbox("Sort by", list(SORT_OPTIONS.keys()), key="portal_sort")
+            with ctrl_col2:
+                status_choice = st.selectbox("Status", ["All"] + STATUSES, key="portal_status")
+            status_arg = None if status_choice == "All" else status_choice
+            matching = count(dept, status_arg)
+            with ctrl_col3:
+                page_size = st.selectbox("Per page", [10, 25, 50], key="portal_page_size")
+            total_pages = max(1, -(-matching // page_size))
+            if st.session_state.get("portal_page", 1) > total_pages:
+                # Filters shrank the list; stay on the last page that exists
+                st.session_state.portal_page = total_pages
+            with ctrl_col4:
+                page = st.number_input("Page", min_value=1, max_value=total_pages, key="portal_page")
+            
+            page_records = by_specialization(
+                dept,
+                status=status_arg,
+                limit=page_size,
+                offset=(page - 1) * page_size,
+                **SORT_OPTIONS[sort_choice]
+            )
+            first_shown = (page - 1) * page_size + 1 if page_records else 0
+            st.caption(f"Showing {first_shown}-{first_shown + len(page_records) - 1 if page_records else 0} of {matching} records · page {page} of {total_pages}")
             
-            # Display each patient record
-            for idx, record in enumerate(dept_records):
-                with st.expander(f"🏥 {record['id']} - {record['name']} ({record['disease']})", expanded=(st.session_state.editing_patient == record['id'])):
+            STATUS_ICONS = {"Reviewed": "✅", "Discharged": "🏠"}
+            
+            # One compact row per record; the detail/edit widgets are only built for the open one
+            for record in page_records:
+                pid = record['id']
+                is_open = st.session_state.open_patient == pid
+                row_col, open_col = st.columns([5, 1])
+                with row_col:
+                    status = record.get('status', 'Pending Review')
+                    st.markdown(f"🏥 **{pid}** - {record['name']} ({record['disease']}) · {STATUS_ICONS.get(status, '⏳')} {status} · {record['date']}")
+                with open_col:
+                    if st.button("Close" if is_open else "Open", key=f"open_{pid}", use_container_width=True):
+                        st.session_state.open_patient = None if is_open else pid
+                        st.session_state.editing_patient = None
+                        st.session_state.editing_version = None
+                        st.rerun()
+                
+                if not is_open:
+                    continue
+                
+                with st.container(border=True):
+                    notice = st.session_state.pop("edit_notice", None)
+                    if notice and notice[0] == pid:
+                        st.warning(notice[1])
                     
                     # Display mode vs Edit mode
                     edit_col, action_col = st.columns([3, 1])
                     
                     with action_col:
-                        if st.session_state.editing_patient == record['id']:
-                            if st.button("❌ Cancel", key=f"cancel_{idx}", use_container_width=True):
+                        if st.session_state.editing_patient == pid:
+                            if st.button("❌ Cancel", key=f"cancel_{pid}", use_container_width=True):
                                 st.session_state.editing_patient = None
+                                st.session_state.editing_version = None
                                 st.rerun()
                         else:
-                            if st.button("✏️ Edit", key=f"edit_{idx}", use_container_width=True):
-                                st.session_state.editing_patient = record['id']
+                            if st.button("✏️ Edit", key=f"edit_{pid}", use_container_width=True):
+                                st.session_state.editing_patient = pid
+                                st.session_state.editing_version = record.get('version', 0)
                                 st.rerun()
                     
                     with edit_col:
-                        if st.session_state.editing_patient == record['id']:
+                        if st.session_state.editing_patient == pid:
                             # EDIT MODE
                             st.markdown("**Edit Patient Information**")
                             
-                            with st.form(key=f"form_{idx}"):
+                            with st.form(key=f"form_{pid}"):
                                 form_col1, form_col2 = st.columns(2)
                                 
                                 with form_col1:
-                                    new_name = st.text_input("Name", value=record['name'], key=f"name_{idx}")
-                                    new_age = st.number_input("Age", min_value=0, max_value=120, value=record['age'], key=f"age_{idx}")
-                                    new_sex = st.selectbox("Sex", ["Male", "Female", "Other"], 
-                                                          index=["Male", "Female", "Other"].index(record['sex']) if record['sex'] in ["Male", "Female", "Other"] else 0,
-                                                          key=f"sex_{idx}")
+                                    new_name = st.text_input("Name", value=record['name'], key=f"name_{pid}")
+                                    new_age = st.number_input("Age", min_value=0, max_value=120, value=record['age'], key=f"age_{pid}")
+                                    # Batch scans without a manifest leave sex unknown; keep it that way unless changed
+                                    current_sex = format_sex(record.get('sex'))
+                                    sex_options = ["Male", "Female", "Other"] + (["Unknown"] if current_sex == "Unknown" else [])
+                                    new_sex = st.selectbox("Sex", sex_options, 
+                                                          index=sex_options.index(current_sex) if current_sex in sex_options else 0,
+                                                          key=f"sex_{pid}")
                                 
                                 with form_col2:
                                     # Read-only fields
-                                    st.text_input("Patient ID (Read-only)", value=record['id'], disabled=True, key=f"pid_{idx}")
-                                    st.text_input("Disease (Read-only)", value=record['disease'], disabled=True, key=f"disease_{idx}")
-                                    st.text_input("Department (Read-only)", value=record['specialization'], disabled=True, key=f"spec_{idx}")
+                                    st.text_input("Patient ID (Read-only)", value=pid, disabled=True, key=f"pid_{pid}")
+                                    st.text_input("Disease (Read-only)", value=record['disease'], disabled=True, key=f"disease_{pid}")
+                                    st.text_input("Department (Read-only)", value=record['specialization'], disabled=True, key=f"spec_{pid}")
                                 
-                                st.text_input("Date (Read-only)", value=record['date'], disabled=True, key=f"date_{idx}")
+                                st.text_input("Date (Read-only)", value=record['date'], disabled=True, key=f"date_{pid}")
                                 
                                 # Status update
                                 current_status = record.get('status', 'Pending Review')
                                 new_status = st.selectbox(
                                     "Review Status",
-                                    ["Pending Review", "Reviewed", "Discharged"],
-                                    index=["Pending Review", "Reviewed", "Discharged"].index(current_status) if current_status in ["Pending Review", "Reviewed", "Discharged"] else 0,
-                                    key=f"status_{idx}"
+                                    STATUSES,
+                                    index=STATUSES.index(current_status) if current_status in STATUSES else 0,
+                                    key=f"status_{pid}"
                                 )
                                 
                                 # Submit button
@@ -632,15 +714,25 @@ with tab4:
                                         updates = {
                                             'name': new_name,
                                             'age': new_age,
-                                            'sex': new_sex,
+                                            'sex': None if new_sex == "Unknown" else new_sex,
                                             'status': new_status
                                         }
                                         
-                                        if update_record(record['id'], updates):
+                                        try:
+                                            saved = update_record(pid, updates, expected_version=st.session_state.editing_version)
+                                        except StaleRecordError:
+                                            # Leave edit mode so the next Edit starts from the latest version
+                                            st.session_state.edit_notice = (pid, "⚠️ Another clinician saved this record while you were editing. Your changes were not saved; review the latest version and edit again.")
+                                            st.session_state.editing_patient = None
+                                            st.session_state.editing_version = None
+                                            st.rerun()
+                                        
+                                        if saved:
                                             st.success("✅ Patient record updated successfully!")
                                             st.session_state.editing_patient = None
+                                            st.session_state.editing_version = None
                                             st.rerun()
-                                        else:
+                                        elif saved is False:
                                             st.error("❌ Failed to update record")
                         
                         else:
@@ -648,10 +740,10 @@ with tab4:
                             info_col1, info_col2 = st.columns(2)
                             
                             with info_col1:
-                                st.markdown(f"**Patient ID:** {record['id']}")
+                                st.markdown(f"**Patient ID:** {pid}")
                                 st.markdown(f"**Name:** {record['name']}")
-                                st.markdown(f"**Age:** {record['age']} years")
-                                st.markdown(f"**Sex:** {record['sex']}")
+                                st.markdown(f"**Age:** {format_age(record.get('age'))}")
+                                st.markdown(f"**Sex:** {format_sex(record.get('sex'))}")
                             
                             with info_col2:
                                 st.markdown(f"**Disease:** {record['disease']}")
@@ -674,25 +766,29 @@ with tab4:
 # --- TAB 5: ANALYTICS ---
 with tab5:
     st.subheader("📊 Medical Analytics Dashboard")
-    records = load_all()
+    # Aggregates are maintained by patient_db on every write; no per-record work here
+    stats = get_stats()
     
-    if records:
-        df = pd.DataFrame(records)
+    if stats["total"]:
+        dept_counts = pd.Series(stats["by_spec"], dtype="int64").sort_values(ascending=False)
+        status_counts = pd.Series(stats["by_status"], dtype="int64").sort_values(ascending=False)
+        gender_counts = pd.Series(stats["by_sex"], dtype="int64").sort_values(ascending=False)
+        disease_counts = pd.Series(stats["by_disease"], dtype="int64").sort_values(ascending=False)
         
         # === TOP METRICS ROW ===
         col1, col2, col3, col4, col5 = st.columns(5)
         with col1:
-            st.metric("Total Patients", len(df))
+            st.metric("Total Patients", stats["total"])
         with col2:
-            st.metric("Departments", df['specialization'].nunique())
+            st.metric("Departments", len(stats["by_spec"]))
         with col3:
-            avg_age = int(df['age'].mean()) if 'age' in df.columns else 0
+            avg_age = int(stats["avg_age"])
             st.metric("Avg Age", f"{avg_age} yrs")
         with col4:
-            pending = len(df[df.get('status', 'Pending Review') == 'Pending Review']) if 'status' in df.columns else 0
+            pending = stats["by_status"].get("Pending Review", 0)
             st.metric("Pending Reviews", pending)
         with col5:
-            unique_diseases = df['disease'].nunique() if 'disease' in df.columns else 0
+            unique_diseases = len(stats["by_disease"])
             st.metric("Unique Conditions", unique_diseases)
         
         st.divider()
@@ -703,29 +799,26 @@ with tab5:
         
         with dept_col1:
             st.markdown("**Patient Distribution by Department**")
-            dept_counts = df['specialization'].value_counts()
             st.bar_chart(dept_counts)
             
             # Department workload table
             st.markdown("**Department Workload**")
-            dept_summary = df.groupby('specialization').agg({
-                'id': 'count',
-                'age': 'mean'
-            }).round(1)
-            dept_summary.columns = ['Patient Count', 'Avg Age']
+            dept_summary = pd.DataFrame({
+                'Patient Count': pd.Series(stats["by_spec"], dtype="int64"),
+                'Avg Age': pd.Series(stats["spec_avg_age"], dtype="float64")
+            }).sort_index().round(1)
             st.dataframe(dept_summary, use_container_width=True)
         
         with dept_col2:
             st.markdown("**Gender Distribution by Department**")
-            if 'sex' in df.columns:
-                gender_dept = pd.crosstab(df['specialization'], df['sex'])
+            if stats["spec_sex"]:
+                gender_dept = pd.Series(stats["spec_sex"]).unstack(fill_value=0)
                 st.bar_chart(gender_dept)
             else:
                 st.info("Gender data not available")
             
             st.markdown("**Status Overview**")
-            if 'status' in df.columns:
-                status_counts = df['status'].value_counts()
+            if stats["by_status"]:
                 st.bar_chart(status_counts)
             else:
                 st.info("Status data not available")
@@ -738,45 +831,29 @@ with tab5:
         
         with disease_col1:
             st.markdown("**Top 10 Most Common Conditions**")
-            if 'disease' in df.columns:
-                disease_counts = df['disease'].value_counts().head(10)
-                st.bar_chart(disease_counts)
+            if stats["by_disease"]:
+                st.bar_chart(disease_counts.head(10))
                 
                 # Disease by department
                 st.markdown("**Conditions by Department**")
-                disease_dept = df.groupby('specialization')['disease'].value_counts().head(15)
-                st.dataframe(disease_dept.reset_index(name='Count'), use_container_width=True, hide_index=True)
+                disease_dept = sorted(
+                    ((spec, disease, n) for (spec, disease), n in stats["spec_disease"].items()),
+                    key=lambda row: (str(row[0]), -row[2])
+                )[:15]
+                st.dataframe(pd.DataFrame(disease_dept, columns=['specialization', 'disease', 'Count']),
+                           use_container_width=True, hide_index=True)
         
         with disease_col2:
             st.markdown("**Disease Severity Distribution**")
-            # Simulate severity based on keywords (in real app, this would come from analysis)
-            severity_keywords = {
-                'High': ['fracture', 'opacity', 'infiltration', 'pneumonia', 'tumor'],
-                'Medium': ['congestion', 'inflammation', 'infection'],
-                'Low': ['minor', 'slight', 'mild']
-            }
-            
-            severity_counts = {'High': 0, 'Medium': 0, 'Low': 0}
-            for disease in df['disease']:
-                disease_lower = str(disease).lower()
-                classified = False
-                for severity, keywords in severity_keywords.items():
-                    if any(keyword in disease_lower for keyword in keywords):
-                        severity_counts[severity] += 1
-                        classified = True
-                        break
-                if not classified:
-                    severity_counts['Medium'] += 1
-            
+            # Severity is stored with each record at save time (see severity.py)
+            severity_counts = {level: stats["by_severity"].get(level, 0) for level in SEVERITY_LEVELS}
             severity_df = pd.DataFrame.from_dict(severity_counts, orient='index', columns=['Count'])
             st.bar_chart(severity_df)
             
             st.markdown("**Recent Critical Cases**")
-            critical_keywords = ['high', 'fracture', 'opacity', 'infiltration']
-            critical_cases = df[df['disease'].str.lower().str.contains('|'.join(critical_keywords), na=False)]
+            critical_cases = pd.DataFrame(recent_critical(5), columns=['id', 'name', 'disease', 'specialization'])
             if not critical_cases.empty:
-                st.dataframe(critical_cases[['id', 'name', 'disease', 'specialization']].head(5), 
-                           use_container_width=True, hide_index=True)
+                st.dataframe(critical_cases, use_container_width=True, hide_index=True)
             else:
                 st.info("No critical cases identified")
         
@@ -788,20 +865,20 @@ with tab5:
         
         with demo_col1:
             st.markdown("**Age Distribution**")
-            st.bar_chart(df['age'].value_counts().sort_index())
+            age_counts = pd.Series(stats["by_age"], dtype="int64").sort_index()
+            st.bar_chart(age_counts)
             
             # Age groups
             st.markdown("**Age Groups**")
             age_bins = [0, 18, 35, 50, 65, 120]
             age_labels = ['0-18', '19-35', '36-50', '51-65', '65+']
-            df['age_group'] = pd.cut(df['age'], bins=age_bins, labels=age_labels, right=False)
-            age_group_counts = df['age_group'].value_counts().sort_index()
+            age_groups = pd.cut(age_counts.index, bins=age_bins, labels=age_labels, right=False)
+            age_group_counts = age_counts.groupby(age_groups, observed=False).sum()
             st.bar_chart(age_group_counts)
         
         with demo_col2:
             st.markdown("**Gender Distribution**")
-            if 'sex' in df.columns:
-                gender_counts = df['sex'].value_counts()
+            if stats["by_sex"]:
                 st.bar_chart(gender_counts)
                 
                 # Gender ratio
@@ -814,15 +891,15 @@ with tab5:
         
         with demo_col3:
             st.markdown("**Patient Timeline**")
-            if 'date' in df.columns:
-                # Extract date from datetime string
-                df['date_only'] = pd.to_datetime(df['date'], errors='coerce').dt.date
-                daily_patients = df['date_only'].value_counts().sort_index()
+            if stats["by_day"]:
+                daily_patients = pd.Series(stats["by_day"], dtype="int64")
+                daily_patients.index = pd.to_datetime(daily_patients.index, errors='coerce').date
+                daily_patients = daily_patients.sort_index()
                 st.line_chart(daily_patients)
                 
                 st.markdown("**Busiest Days**")
                 top_days = daily_patients.head(5)
-                st.dataframe(top_days.reset_index().rename(columns={'index': 'Date', 'date_only': 'Patients'}), 
+                st.dataframe(pd.DataFrame({'Date': top_days.index, 'Patients': top_days.values}), 
                            use_container_width=True, hide_index=True)
         
         st.divider()
@@ -833,36 +910,58 @@ with tab5:
         # Filters
         filter_col1, filter_col2, filter_col3 = st.columns(3)
         with filter_col1:
-            dept_filter = st.selectbox("Filter by Department", ["All"] + list(df['specialization'].unique()))
+            dept_filter = st.selectbox("Filter by Department", ["All"] + list(stats["by_spec"].keys()))
         with filter_col2:
-            if 'status' in df.columns:
-                status_filter = st.selectbox("Filter by Status", ["All"] + list(df['status'].unique()))
+            if stats["by_status"]:
+                status_filter = st.selectbox("Filter by Status", ["All"] + list(stats["by_status"].keys()))
             else:
                 status_filter = "All"
         with filter_col3:
-            search_term = st.text_input("Search by Name/ID", "")
-        
-        # Apply filters
-        filtered_df = df.copy()
-        if dept_filter != "All":
-            filtered_df = filtered_df[filtered_df['specialization'] == dept_filter]
-        if status_filter != "All" and 'status' in filtered_df.columns:
-            filtered_df = filtered_df[filtered_df['status'] == status_filter]
+            search_term = st.text_input("Search by Name/ID/Condition", "")
+        dept_arg = None if dept_filter == "All" else dept_filter
+        status_arg = None if status_filter == "All" else status_filter
+        
+        # Only one page of records is read per rerun, so the tab stays fast as the registry grows
+        ANALYTICS_SEARCH_LIMIT = 1000
         if search_term:
-            filtered_df = filtered_df[
-                filtered_df['name'].str.contains(search_term, case=False, na=False) | 
-                filtered_df['id'].str.contains(search_term, case=False, na=False)
-            ]
+            search_hits = search(search_term, dept_arg, limit=ANALYTICS_SEARCH_LIMIT)
+            # Decided before the status filter, which can cut a capped result below the limit
+            search_capped = len(search_hits) >= ANALYTICS_SEARCH_LIMIT
+            if status_arg:
+                search_hits = [r for r in search_hits if r.get("status") == status_arg]
+            matching = len(search_hits)
+        else:
+            search_hits = None
+            search_capped = False
+            matching = count(dept_arg, status_arg)
+        
+        page_col1, page_col2 = st.columns([1, 1])
+        with page_col1:
+            table_page_size = st.selectbox("Rows per page", [25, 50, 100], key="analytics_page_size")
+        table_pages = max(1, -(-matching // table_page_size))
+        if st.session_state.get("analytics_page", 1) > table_pages:
+            st.session_state.analytics_page = table_pages
+        with page_col2:
+            table_page = st.number_input("Page", min_value=1, max_value=table_pages, key="analytics_page")
+        offset = (table_page - 1) * table_page_size
+        if search_hits is not None:
+            page_records = search_hits[offset:offset + table_page_size]
+        else:
+            page_records = filter_records(dept_arg, status_arg, limit=table_page_size, offset=offset)
         
-        st.caption(f"Showing {len(filtered_df)} of {len(df)} records")
+        display_columns = ['id', 'name', 'age', 'sex', 'disease', 'specialization', 'severity', 'date', 'status']
+        page_df = pd.DataFrame(page_records).reindex(columns=display_columns)
+        # Records saved before severity was stored get it derived from their condition
+        page_df['severity'] = page_df['severity'].fillna(classify_series(page_df['disease']))
         
-        # Display table
-        display_columns = ['id', 'name', 'age', 'sex', 'disease', 'specialization', 'date']
-        if 'status' in filtered_df.columns:
-            display_columns.append('status')
+        shown_from = offset + 1 if page_records else 0
+        capped = " (best matches only)" if search_capped else ""
+        st.caption(f"Showing {shown_from}-{offset + len(page_records)} of {matching} matching records{capped} · "
+                   f"{stats['total']} in total")
         
+        # Display table (newest first, or best match first when searching)
         st.dataframe(
-            filtered_df[display_columns].sort_values('date', ascending=False),
+            page_df,
             use_container_width=True,
             hide_index=True,
             column_config={
@@ -872,20 +971,33 @@ with tab5:
                 "sex": "Gender",
                 "disease": "Condition",
                 "specialization": "Department",
+                "severity": "Severity",
                 "date": "Date",
                 "status": "Status"
             }
         )
         
-        # Export option
-        st.download_button(
-            label="📥 Export Data as CSV",
-            data=filtered_df.to_csv(index=False).encode('utf-8'),
-            file_name=f"mediscan_analytics_{timestamp_now().replace(' ', '_').replace(':', '-')}.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
+        # Export option: the CSV covers every matching record, so it is only built on request
+        # and reused until the filters or the registry change
+        csv_key = (dept_arg, status_arg, search_term, generation())
+        cached_csv = st.session_state.get("analytics_csv")
+        if cached_csv and cached_csv[0] == csv_key:
+            st.download_button(
+                label="📥 Download CSV",
+                data=cached_csv[1],
+                file_name=f"mediscan_analytics_{timestamp_now().replace(' ', '_').replace(':', '-')}.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+        elif st.button("📥 Prepare CSV Export", use_container_width=True):
+            with st.spinner("Building CSV..."):
+                export_df = pd.DataFrame(
+                    search_hits if search_hits is not None else filter_records(dept_arg, status_arg)
+                ).reindex(columns=display_columns)
+                export_df['severity'] = export_df['severity'].fillna(classify_series(export_df['disease']))
+                st.session_state.analytics_csv = (csv_key, export_df.to_csv(index=False).encode('utf-8'))
+            st.rerun()
         
     else:
         st.info("📊 No patient data available yet. Start by scanning and saving patient records.")
-        st.caption("Analytics will appear here once you have patient data.")
\ No newline at end of file
+        st.caption("Analytics will appear here once you have patient data.")
@@ -1,25 +1,274 @@
 import uuid
+import atexit
+import bisect
 import datetime
 import json
 import os
+import threading
+from contextlib import contextmanager
+
+from db_backends import open_backend, JsonBackend, SqliteBackend
+from search_index import TrigramIndex, SEARCH_FIELDS
+from analytics_store import RegistryStats
+from severity import severity_fields, record_is_critical
 
 # JSON file for persistent storage
 JSON_FILE = "patient_data.json"
+SQLITE_FILE = "patient_data.db"
 
-def _load_from_json():
-    """Load data from JSON file."""
-    if os.path.exists(JSON_FILE):
-        try:
-            with open(JSON_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+# Backend selection: MEDISCAN_DB_BACKEND = "json" (default), "journal" or "sqlite".
+# "journal" keeps patient_data.json as a snapshot and appends writes to
+# patient_data.json.journal. MEDISCAN_DB_PATH overrides the file the backend uses.
+DB_BACKEND = os.getenv("MEDISCAN_DB_BACKEND", "json")
+DB_PATH = os.getenv("MEDISCAN_DB_PATH")
+
+_backend = None
+
+
+def _index_keys(record):
+    """Secondary index keys a record is filed under."""
+    spec = str(record.get("specialization") or "").lower()
+    status = record.get("status")
+    keys = [(), ("spec", spec), ("status", status), ("spec_status", spec, status)]
+    if record_is_critical(record):
+        keys.append(("critical",))
+    return keys
+
+def _index_entry(record):
+    return (str(record.get("date") or ""), record["id"])
+
+
+class _RecordCache:
+    """
+    Parsed records kept in memory between Streamlit reruns.
+    `signature` is the backend's change token at load time; the records are
+    only read again when another process changes the underlying storage.
+    Returned records are shared with the cache and should be treated as read-only.
+
+    `index` maps a key from _index_keys() to a date-sorted list of (date, id),
+    so filtered queries bisect and slice instead of scanning every record.
+    `text_index` is the trigram index behind search(). Like by_id, both hold
+    the first record for any duplicated ID. `stats` aggregates every record
+    for the Analytics dashboard.
+
+    `generation` goes up on every load, invalidation and write through this
+    process. The backend signature can miss this process's own writes (e.g.
+    SQLite's data_version), so data derived from the records is keyed on it.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.generation = 0
+        self.invalidate()
+
+    def invalidate(self):
+        self.generation += 1
+        self.records = []
+        self.by_id = {}
+        self.index = {}
+        self.text_index = TrigramIndex(group_field="specialization")
+        self.stats = RegistryStats()
+        self.signature = None
+        self.loaded = False
+
+    def load(self, records, signature):
+        self.generation += 1
+        self.records = records
+        self.by_id = {}
+        for r in records:
+            # Keep the first occurrence, as find_by_id always has.
+            self.by_id.setdefault(r["id"], r)
+        self.index = {}
+        for r in self.by_id.values():
+            entry = _index_entry(r)
+            for key in _index_keys(r):
+                self.index.setdefault(key, []).append(entry)
+        for entries in self.index.values():
+            entries.sort()
+        self.text_index = TrigramIndex(group_field="specialization")
+        self.text_index.add_many(self.by_id.items())
+        self.stats = RegistryStats()
+        for r in records:
+            self.stats.add(r)
+        self.signature = signature
+        self.loaded = True
+
+    def _index_add(self, record):
+        entry = _index_entry(record)
+        for key in _index_keys(record):
+            bisect.insort(self.index.setdefault(key, []), entry)
+
+    def _index_remove(self, record):
+        entry = _index_entry(record)
+        for key in _index_keys(record):
+            entries = self.index.get(key, [])
+            i = bisect.bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+
+    def apply_add(self, record):
+        self.records.append(record)
+        self.stats.add(record)
+        if record["id"] not in self.by_id:
+            self.by_id[record["id"]] = record
+            self._index_add(record)
+            self.text_index.add(record["id"], record)
+
+    def apply_update(self, pid, updates):
+        rec = self.by_id[pid]
+        self._index_remove(rec)
+        self.stats.remove(rec)
+        rec.update(updates)
+        self._index_add(rec)
+        self.stats.add(rec)
+        if any(f in updates for f in SEARCH_FIELDS + ("specialization",)):
+            self.text_index.add(pid, rec)
+
+    def apply_delete(self, pid):
+        kept = []
+        for r in self.records:
+            if r["id"] == pid:
+                self.stats.remove(r)
+            else:
+                kept.append(r)
+        self.records = kept
+        rec = self.by_id.pop(pid, None)
+        if rec is not None:
+            self._index_remove(rec)
+            self.text_index.remove(pid)
+
+
+_cache = _RecordCache()
+
+def _default_path(kind):
+    return SQLITE_FILE if kind.lower() == "sqlite" else JSON_FILE
+
+def configure(backend=None, path=None):
+    """Selects the storage backend (and its file) used by the functions below."""
+    global DB_BACKEND, DB_PATH, _backend
+    _close_backend()
+    if backend:
+        DB_BACKEND = backend
+    DB_PATH = path
+    _backend = None
+    _cache.invalidate()
+    return get_backend()
+
+def _close_backend():
+    if _backend is not None and hasattr(_backend, "close"):
+        _backend.close()
+
+atexit.register(_close_backend)
+
+def get_backend():
+    """Returns the active storage backend, opening it on first use."""
+    global _backend
+    if _backend is None:
+        path = DB_PATH or _default_path(DB_BACKEND)
+        is_new = not os.path.exists(path)
+        _backend = open_backend(DB_BACKEND, path)
+        if (is_new and isinstance(_backend, SqliteBackend) and os.path.exists(JSON_FILE)
+                and os.path.abspath(path) == os.path.abspath(SQLITE_FILE)):
+            # First start of the default SQLite registry: bring the JSON registry
+            # over once. Any other path starts empty; use migrate_from_json for it.
+            migrate_from_json(JSON_FILE, _backend)
+    return _backend
+
+def migrate_from_json(json_path=JSON_FILE, target=None):
+    """
+    One-shot import of a JSON registry into a SQLite database.
+    `target` may be a SqliteBackend or a path; returns the number of records imported.
+    """
+    if target is None:
+        target = SQLITE_FILE
+    if isinstance(target, str):
+        target = SqliteBackend(target)
+    records = JsonBackend(json_path).load_all()
+    return target.add_many(records)
+
+def _fresh_cache():
+    """Returns the cache, reloading it if the storage changed underneath us. Call with _cache.lock held."""
+    backend = get_backend()
+    signature = backend.signature()
+    if not _cache.loaded or signature != _cache.signature:
+        _cache.load(backend.load_all(), signature)
+    return _cache
+
+class StaleRecordError(Exception):
+    """Raised by update_record when the record changed since the caller read it."""
+
+    def __init__(self, pid, expected, actual):
+        super().__init__(f"Record {pid} is at version {actual}, expected {expected}")
+        self.pid = pid
+        self.expected = expected
+        self.actual = actual
+
+@contextmanager
+def _writing():
+    """
+    Holds the in-process and cross-process write locks around a
+    read-modify-write, with the cache freshly synced to storage.
+    Yields (backend, cache); the cache is dropped if the write fails midway.
+    """
+    with _cache.lock:
+        backend = get_backend()
+        with backend.lock():
+            cache = _fresh_cache()
+            try:
+                yield backend, cache
+            except Exception:
+                cache.invalidate()
+                raise
+            cache.signature = backend.signature()
+            cache.generation += 1
 
-def _save_to_json(data):
-    """Save data to JSON file."""
-    with open(JSON_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+def compact():
+    """Folds the write-ahead journal into the snapshot (journal backend only)."""
+    with _writing() as (backend, cache):
+        if not hasattr(backend, "compact"):
+            return False
+        backend.compact(cache.records)
+        return True
+
+FIRST_PATIENT_NUMBER = 1000
+
+def _seq_path(backend):
+    return backend.path + ".seq"
+
+def _highest_patient_number(records, prefix):
+    highest = None
+    for r in records:
+        pid = str(r.get("id", ""))
+        if pid.startswith(prefix):
+            try:
+                n = int(pid[len(prefix):])
+            except ValueError:
+                continue
+            highest = n if highest is None else max(highest, n)
+    return highest
+
+def next_patient_id(prefix="PID-"):
+    """
+    Allocates a new, never-reused patient ID such as "PID-1042".
+    The high-water mark lives in <registry>.seq and is bumped under the
+    registry's write lock, so concurrent sessions and processes never get the
+    same ID. Only the very first call scans the records to seed it.
+    """
+    with _writing() as (backend, cache):
+        path = _seq_path(backend)
+        try:
+            with open(path, 'r') as f:
+                n = json.load(f)["next"]
+        except (OSError, ValueError, KeyError):
+            highest = _highest_patient_number(cache.records, prefix)
+            n = FIRST_PATIENT_NUMBER if highest is None else highest + 1
+        while f"{prefix}{n}" in cache.by_id:
+            n += 1
+        tmp = path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"next": n + 1}, f)
+        os.replace(tmp, path)
+        return f"{prefix}{n}"
 
 def make_patient_entry(name, age, sex, pid, disease="Unknown", specialization="general"):
     """Creates a dictionary structure for a patient."""
@@ -32,57 +281,227 @@ def make_patient_entry(name, age, sex, pid, disease="Unknown", specialization="g
         "disease": disease,
         "specialization": specialization,
         "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "status": "Pending Review"
+        "status": "Pending Review",
+        "version": 1,
+        **severity_fields(disease)
     }
 
 def add_record(record):
     """Adds a record to the database."""
-    data = _load_from_json()
-    data.append(record)
-    _save_to_json(data)
-    return True
+    record.setdefault("version", 1)
+    with _writing() as (backend, cache):
+        ok = backend.add(record, records=cache.records)
+        if ok:
+            cache.apply_add(record)
+        return ok
+
+def add_records(records):
+    """
+    Adds many records in one write (one file rewrite, journal sync or SQLite
+    transaction). Records whose ID is already registered, or repeated within
+    the batch, are skipped. Returns the number added.
+    """
+    with _writing() as (backend, cache):
+        fresh, seen = [], set(cache.by_id)
+        for record in records:
+            if record["id"] in seen:
+                continue
+            seen.add(record["id"])
+            record.setdefault("version", 1)
+            fresh.append(record)
+        if not fresh:
+            return 0
+        backend.add_many(fresh, records=cache.records)
+        for record in fresh:
+            cache.apply_add(record)
+        return len(fresh)
 
 def load_all():
     """Returns all records."""
-    return _load_from_json()
+    with _cache.lock:
+        return list(_fresh_cache().records)
 
 def find_by_id(pid):
     """Finds a record by Patient ID."""
-    data = _load_from_json()
-    for r in data:
-        if r["id"] == pid:
-            return r
-    return None
-
-def search(query, specialization=None):
-    """Search by text or filter by specialization."""
-    results = _load_from_json()
-    if specialization and specialization != "all":
-        results = [r for r in results if r["specialization"].lower() == specialization.lower()]
-    
-    # Simple text search (if query exists)
-    if query:
-        q = query.lower()
-        results = [r for r in results if q in r["name"].lower() or q in r["id"].lower()]
-        
-    return results
-
-def update_record(pid, updates):
-    """Updates specific fields of a record."""
-    data = _load_from_json()
-    for rec in data:
-        if rec["id"] == pid:
-            rec.update(updates)
-            _save_to_json(data)
-            return True
-    return False
+    with _cache.lock:
+        return _fresh_cache().by_id.get(pid)
+
+# Review workflow, in the order the portal lists them
+STATUSES = ["Pending Review", "Reviewed", "Discharged"]
+
+# search() returns at most this many records unless the caller asks otherwise
+DEFAULT_SEARCH_LIMIT = 50
+
+def _as_date_key(value):
+    if value is None:
+        return None
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+def _select_key(specialization, status):
+    spec = specialization.lower() if specialization and specialization != "all" else None
+    if spec is not None and status is not None:
+        return ("spec_status", spec, status)
+    if spec is not None:
+        return ("spec", spec)
+    if status is not None:
+        return ("status", status)
+    return ()
+
+def _date_range(entries, since, until):
+    lo = bisect.bisect_left(entries, (_as_date_key(since),)) if since is not None else 0
+    hi = bisect.bisect_left(entries, (_as_date_key(until),)) if until is not None else len(entries)
+    return lo, max(lo, hi)
+
+def _page(entries, lo, hi, offset, limit, newest_first):
+    """Slices entries[lo:hi] in the requested direction."""
+    if newest_first:
+        stop = max(lo, hi - offset)
+        start = max(lo, stop - limit) if limit is not None else lo
+        return entries[start:stop][::-1]
+    start = min(hi, lo + offset)
+    stop = min(hi, start + limit) if limit is not None else hi
+    return entries[start:stop]
+
+def _status_sort_key(status):
+    return (STATUSES.index(status) if status in STATUSES else len(STATUSES), str(status))
+
+def filter_records(specialization=None, status=None, since=None, until=None, limit=None, offset=0,
+                   newest_first=True, sort_by="date"):
+    """
+    Records filtered by department, status and date range, using the secondary indexes.
+    `since`/`until` take a date, datetime or "YYYY-MM-DD[ HH:MM:SS]" string;
+    `until` is exclusive. sort_by="status" groups records in STATUSES order,
+    by date within each group. Cost grows with the size of the page returned.
+    """
+    with _cache.lock:
+        cache = _fresh_cache()
+        if sort_by == "status" and status is None:
+            spec = specialization.lower() if specialization and specialization != "all" else None
+            if spec is None:
+                keys = [k for k in cache.index if k[:1] == ("status",)]
+            else:
+                keys = [k for k in cache.index if k[:2] == ("spec_status", spec)]
+            groups = [cache.index[k] for k in sorted(keys, key=lambda k: _status_sort_key(k[-1]))]
+        else:
+            groups = [cache.index.get(_select_key(specialization, status), [])]
+
+        page = []
+        for entries in groups:
+            if limit is not None and len(page) >= limit:
+                break
+            lo, hi = _date_range(entries, since, until)
+            if offset >= hi - lo:
+                offset -= hi - lo
+                continue
+            page += _page(entries, lo, hi, offset, None if limit is None else limit - len(page), newest_first)
+            offset = 0
+        return [cache.by_id[pid] for _, pid in page]
+
+def count(specialization=None, status=None, since=None, until=None):
+    """Number of records in a department and/or with a status, read off the indexes."""
+    with _cache.lock:
+        entries = _fresh_cache().index.get(_select_key(specialization, status), [])
+        lo, hi = _date_range(entries, since, until)
+        return hi - lo
+
+def by_specialization(spec, status=None, since=None, limit=None, offset=0, newest_first=True, sort_by="date"):
+    """Records of one department, newest first unless `newest_first` is False."""
+    return filter_records(spec, status, since=since, limit=limit, offset=offset,
+                          newest_first=newest_first, sort_by=sort_by)
+
+def by_status(status, since=None, limit=None, offset=0, newest_first=True):
+    """Records with the given review status."""
+    return filter_records(status=status, since=since, limit=limit, offset=offset, newest_first=newest_first)
+
+def recent_critical(limit=5):
+    """Newest records whose condition matches the critical keywords (see severity.py)."""
+    with _cache.lock:
+        cache = _fresh_cache()
+        entries = cache.index.get(("critical",), [])
+        return [cache.by_id[pid] for _, pid in _page(entries, 0, len(entries), 0, limit, True)]
+
+def generation():
+    """Token that changes whenever the registry does, including writes made by this process."""
+    with _cache.lock:
+        return _fresh_cache().generation
+
+def get_stats():
+    """Dashboard aggregates (counts per department/status/sex/disease/day, ages), kept current on every write."""
+    with _cache.lock:
+        return _fresh_cache().stats.snapshot()
+
+def search(query, specialization=None, limit=DEFAULT_SEARCH_LIMIT, fuzzy=True):
+    """
+    Search name, id and disease, best matches first, optionally within one department.
+    Exact substring hits rank as whole-field match, prefix, word prefix, then
+    anywhere; with `fuzzy`, a query with no hits falls back to near matches.
+    At most `limit` records are returned (None for all). Queries shorter than
+    three characters only match the start of a field or of a word in it.
+    """
+    if not query:
+        if specialization and specialization != "all":
+            return filter_records(specialization, limit=limit, newest_first=False)
+        return load_all()[:limit]
+
+    spec = specialization.lower() if specialization and specialization != "all" else None
+    with _cache.lock:
+        cache = _fresh_cache()
+        ids = cache.text_index.search(query, limit, group=spec)
+        if not ids and fuzzy:
+            ids = cache.text_index.fuzzy(query, limit, group=spec)
+        if not ids:
+            rec = cache.by_id.get(str(query).strip())
+            if rec is not None and (spec is None or str(rec.get("specialization") or "").lower() == spec):
+                ids = [rec["id"]]
+        return [cache.by_id[pid] for pid in ids]
+
+def update_record(pid, updates, expected_version=None):
+    """
+    Updates specific fields of a record and bumps its `version`.
+    Pass the `version` you read as `expected_version` to refuse the write
+    (StaleRecordError) if someone else saved the record in the meantime.
+    """
+    with _writing() as (backend, cache):
+        rec = cache.by_id.get(pid)
+        if rec is None:
+            return False
+        version = rec.get("version", 0)
+        if expected_version is not None and version != expected_version:
+            raise StaleRecordError(pid, expected_version, version)
+        updates = {**updates, "version": version + 1}
+        if "disease" in updates and "severity" not in updates:
+            updates.update(severity_fields(updates["disease"]))
+        ok = backend.update(pid, updates, records=cache.records)
+        if ok:
+            cache.apply_update(pid, updates)
+        return ok
 
 def delete_record(pid):
     """Removes a record."""
-    data = _load_from_json()
-    initial_len = len(data)
-    data = [r for r in data if r["id"] != pid]
-    if len(data) < initial_len:
-        _save_to_json(data)
-        return True
-    return False
\ No newline at end of file
+    with _writing() as (backend, cache):
+        if pid not in cache.by_id:
+            return False
+        ok = backend.delete(pid, records=cache.records)
+        if ok:
+            cache.apply_delete(pid)
+        return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MediScan patient registry tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    mig = sub.add_parser("migrate", help="Import a JSON registry into SQLite")
+    mig.add_argument("--json", default=JSON_FILE)
+    mig.add_argument("--sqlite", default=SQLITE_FILE)
+    sub.add_parser("compact", help="Fold the journal into patient_data.json")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        n = migrate_from_json(args.json, args.sqlite)
+        print(f"Imported {n} records from {args.json} into {args.sqlite}")
+    elif args.command == "compact":
+        print("Journal compacted" if compact() else f"Backend '{DB_BACKEND}' has no journal")
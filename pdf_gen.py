@@ -3,194 +3,355 @@ from reportlab.lib.pagesizes import letter, A4
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
 from reportlab.lib.units import inch
-from reportlab.platypus import Paragraph, Frame
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from collections import OrderedDict
+from functools import lru_cache
+from PIL import Image
+import hashlib
+import os
 import re
 
-def create_medical_pdf(patient_data, scan_results, deep_analysis, image_path=None):
+from utils import format_age, format_sex
+
+PAGE_WIDTH, PAGE_HEIGHT = letter
+MARGIN = 50
+BOTTOM = 100  # body text stops here; the footer sits below
+BRAND_COLOR = colors.HexColor("#1e3a8a")
+RULE_COLOR = colors.HexColor("#3b82f6")
+SECTION_HEADERS = ("Observation:", "Severity:", "Recommendation:", "Risk_Percentage:", "Registry Summary:")
+
+# Visual evidence box, in points
+IMAGE_BOX = (PAGE_WIDTH - 100, 300)
+# Resolution and JPEG quality of embedded scans; "original" embeds the image untouched
+IMAGE_PROFILES = {
+    "screen": {"dpi": 96, "quality": 70},
+    "standard": {"dpi": 150, "quality": 80},
+    "print": {"dpi": 300, "quality": 90},
+    "original": None,
+}
+DEFAULT_IMAGE_PROFILE = os.getenv("MEDISCAN_PDF_PROFILE", "standard")
+EMBED_CACHE_SIZE = 64
+
+def _image_source(image):
+    """drawImage source for encoded bytes, a PIL image or a file path."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        # JPEG bytes are embedded as-is, without decoding or re-compression
+        return ImageReader(BytesIO(bytes(image)))
+    if hasattr(image, "getdata"):
+        return ImageReader(image)
+    return image
+
+_embed_cache = OrderedDict()
+
+def embed_image(image, profile=None, box=IMAGE_BOX):
+    """
+    JPEG bytes of `image` (bytes, PIL image or path) resampled to the
+    profile's DPI at the size it will occupy in `box`. Results are cached by
+    content, so a scan shared by many reports is resampled once and, being
+    byte-identical, embedded once per document by ReportLab.
+    """
+    settings = IMAGE_PROFILES[profile or DEFAULT_IMAGE_PROFILE]
+    if settings is None:
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        data = bytes(image)
+    elif hasattr(image, "getdata"):
+        data = None
+    else:
+        with open(image, 'rb') as f:
+            data = f.read()
+    digest = hashlib.sha256(data if data is not None else image.tobytes())
+    digest.update(repr((profile, box, None if data is not None else (image.mode, image.size))).encode())
+    key = digest.hexdigest()
+    if key in _embed_cache:
+        _embed_cache.move_to_end(key)
+        return _embed_cache[key]
+
+    pil_img = Image.open(BytesIO(data)) if data is not None else image
+    w, h = pil_img.size
+    scale = min(box[0] / w, box[1] / h) * settings["dpi"] / 72
+    target = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if data is not None and pil_img.format == "JPEG" and w <= target[0]:
+        # Already small enough; embed the JPEG as-is
+        out = data
+    else:
+        img = pil_img.convert("L" if pil_img.mode in ("L", "I", "I;16") else "RGB")
+        if w > target[0]:
+            img = img.resize(target, Image.LANCZOS)
+        buf = BytesIO()
+        img.save(buf, "JPEG", quality=settings["quality"])
+        out = buf.getvalue()
+
+    _embed_cache[key] = out
+    if len(_embed_cache) > EMBED_CACHE_SIZE:
+        _embed_cache.popitem(last=False)
+    return out
+
+# --- Layout primitives ---
+
+@lru_cache(maxsize=16384)
+def _width(word, font, size):
+    # Narratives repeat most of their words; measure each once
+    return stringWidth(word, font, size)
+
+def wrap_text(text, font, size, max_width):
+    """
+    Splits text into lines no wider than max_width points, measured with
+    the font's real glyph widths. Words longer than a line are broken.
+    """
+    words = text.split()
+    if len(text) < 200 and _width(" ".join(words), font, size) <= max_width:
+        return [" ".join(words)] if words else []
+    space = _width(" ", font, size)
+    lines, current, current_width = [], [], 0.0
+    for word in words:
+        word_width = _width(word, font, size)
+        if word_width > max_width:
+            if current:
+                lines.append(" ".join(current))
+            piece = ""
+            for ch in word:
+                if piece and stringWidth(piece + ch, font, size) > max_width:
+                    lines.append(piece)
+                    piece = ""
+                piece += ch
+            current, current_width = [piece], stringWidth(piece, font, size)
+            continue
+        extra = word_width + (space if current else 0)
+        if current and current_width + extra > max_width:
+            lines.append(" ".join(current))
+            current, current_width = [word], word_width
+        else:
+            current.append(word)
+            current_width += extra
+    if current:
+        lines.append(" ".join(current))
+    return lines
+
+def _draw_header(c):
+    # Professional Header with Blue Background
+    c.setFillColor(BRAND_COLOR)
+    c.rect(0, PAGE_HEIGHT - 80, PAGE_WIDTH, 80, fill=True, stroke=False)
+    c.setFillColor(colors.white)
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(50, PAGE_HEIGHT - 45, "MediScan AI")
+    c.setFont("Helvetica", 12)
+    c.drawString(50, PAGE_HEIGHT - 65, "Clinical Diagnostic Report")
+
+def _draw_header_continued(c):
+    # Slim band on continuation pages
+    c.setFillColor(BRAND_COLOR)
+    c.rect(0, PAGE_HEIGHT - 36, PAGE_WIDTH, 36, fill=True, stroke=False)
+    c.setFillColor(colors.white)
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(50, PAGE_HEIGHT - 23, "MediScan AI · Clinical Diagnostic Report (continued)")
+
+def _draw_footer(c):
+    c.setFont("Helvetica-Oblique", 8)
+    c.setFillColor(colors.grey)
+    c.drawString(50, 30, "This report is generated by MediScan AI for diagnostic assistance purposes.")
+    c.drawRightString(PAGE_WIDTH - 50, 30, "Confidential Medical Document")
+
+# Static page furniture, each drawn once per document as a form XObject
+FORMS = {
+    "mediscan_header": _draw_header,
+    "mediscan_header_continued": _draw_header_continued,
+    "mediscan_footer": _draw_footer,
+}
+
+def place_form(c, name):
+    """Draws form `name` on the current page, defining it on first use in this document."""
+    if not c.hasForm(name):
+        c.beginForm(name)
+        FORMS[name](c)
+        c.endForm()
+    c.doForm(name)
+
+class PageTemplate:
+    """Static forms placed on a page and where its body starts."""
+
+    def __init__(self, forms, top):
+        self.forms = forms
+        self.top = top
+
+    def apply(self, c):
+        for form in self.forms:
+            place_form(c, form)
+        return self.top
+
+FIRST_PAGE = PageTemplate(["mediscan_header", "mediscan_footer"], PAGE_HEIGHT - 120)
+CONTINUATION_PAGE = PageTemplate(["mediscan_header_continued", "mediscan_footer"], PAGE_HEIGHT - 70)
+
+class ReportLayout:
+    """Cursor over a canvas that starts new pages from a template when content runs out."""
+
+    def __init__(self, c, first=FIRST_PAGE, continuation=CONTINUATION_PAGE):
+        self.c = c
+        self.continuation = continuation
+        self.y = first.apply(c)
+
+    def ensure_space(self, needed):
+        if self.y - needed < BOTTOM:
+            self.c.showPage()
+            self.y = self.continuation.apply(self.c)
+
+    def section(self, title):
+        """Section heading with a rule under it."""
+        self.ensure_space(60)
+        c = self.c
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(MARGIN, self.y, title)
+        self.y -= 5
+        c.setStrokeColor(RULE_COLOR)
+        c.setLineWidth(2)
+        c.line(MARGIN, self.y, PAGE_WIDTH - MARGIN, self.y)
+
+    def field(self, label, value, x=MARGIN, value_x=None):
+        """Bold label and plain value on the current line."""
+        c = self.c
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica-Bold", 11)
+        c.drawString(x, self.y, label)
+        c.setFont("Helvetica", 11)
+        c.drawString(value_x if value_x is not None else x + 100, self.y, str(value))
+
+    def paragraph(self, text, font="Helvetica", size=10, x=MARGIN, leading=15, right=PAGE_WIDTH - MARGIN):
+        """Wrapped text, paginating as needed."""
+        self.lines(wrap_text(text, font, size, right - x), font, size, x, leading)
+
+    def lines(self, lines, font="Helvetica", size=10, x=MARGIN, leading=15):
+        """Already-wrapped lines, drawn as one text object per page rather than one per line."""
+        while lines:
+            self.ensure_space(leading)
+            fit = max(1, int((self.y - BOTTOM) // leading))
+            text_obj = self.c.beginText(x, self.y)
+            text_obj.setFont(font, size, leading)
+            text_obj.textLines(lines[:fit])
+            self.c.drawText(text_obj)
+            self.y -= leading * len(lines[:fit])
+            lines = lines[fit:]
+
+# --- Report ---
+
+def create_medical_pdf(patient_data, scan_results, deep_analysis, image_path=None, image=None, image_profile=None):
     """
     Generates a professional medical PDF report using ReportLab.
+    The visual evidence is `image` (encoded bytes or a PIL image, no disk
+    I/O) or the file at `image_path`, resampled per `image_profile`
+    (see IMAGE_PROFILES).
     Returns bytes.
     """
     buffer = BytesIO()
     c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    # Professional Header with Blue Background
-    c.setFillColor(colors.HexColor("#1e3a8a"))
-    c.rect(0, height - 80, width, 80, fill=True, stroke=False)
-    
+    draw_medical_report(c, patient_data, scan_results, deep_analysis,
+                        image if image is not None else image_path, image_profile)
+    c.save()
+    buffer.seek(0)
+    return buffer.getvalue()
+
+def _severity_color(severity):
+    # Color code severity
+    severity = str(severity).lower()
+    if severity == 'high':
+        return colors.red
+    if severity in ('med', 'medium'):
+        return colors.orange
+    return colors.green
+
+def draw_medical_report(c, patient_data, scan_results, deep_analysis, image=None, image_profile=None):
+    """
+    Draws one report onto canvas `c`, starting on its current page, so
+    several reports can share one document. The last page is left open;
+    call c.showPage() before drawing the next report.
+    """
+    width, height = PAGE_WIDTH, PAGE_HEIGHT
+    layout = ReportLayout(c)
+
+    # Date on right side of the header
     c.setFillColor(colors.white)
-    c.setFont("Helvetica-Bold", 24)
-    c.drawString(50, height - 45, "MediScan AI")
-    c.setFont("Helvetica", 12)
-    c.drawString(50, height - 65, "Clinical Diagnostic Report")
-    
-    # Date on right side
     c.setFont("Helvetica", 10)
     c.drawRightString(width - 50, height - 50, f"Generated: {patient_data.get('date')}")
-    
+
     # Patient Information Section
-    y_pos = height - 120
-    c.setFillColor(colors.black)
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, y_pos, "Patient Information")
-    
-    # Draw a subtle line
-    y_pos -= 5
-    c.setStrokeColor(colors.HexColor("#3b82f6"))
-    c.setLineWidth(2)
-    c.line(50, y_pos, width - 50, y_pos)
-    
-    y_pos -= 25
-    c.setFillColor(colors.black)
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(50, y_pos, "Name:")
-    c.setFont("Helvetica", 11)
-    c.drawString(150, y_pos, str(patient_data.get('name')))
-    
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(350, y_pos, "Patient ID:")
-    c.setFont("Helvetica", 11)
-    c.drawString(450, y_pos, str(patient_data.get('id')))
-    
-    y_pos -= 20
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(50, y_pos, "Age:")
-    c.setFont("Helvetica", 11)
-    c.drawString(150, y_pos, f"{patient_data.get('age')} years")
-    
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(350, y_pos, "Sex:")
-    c.setFont("Helvetica", 11)
-    c.drawString(450, y_pos, str(patient_data.get('sex')))
-    
+    layout.section("Patient Information")
+    layout.y -= 25
+    layout.field("Name:", patient_data.get('name'))
+    layout.field("Patient ID:", patient_data.get('id'), x=350)
+    layout.y -= 20
+    layout.field("Age:", format_age(patient_data.get('age')))
+    layout.field("Sex:", format_sex(patient_data.get('sex')), x=350)
+
     # Diagnostic Findings Section
-    y_pos -= 40
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, y_pos, "Diagnostic Findings")
-    y_pos -= 5
-    c.setStrokeColor(colors.HexColor("#3b82f6"))
-    c.line(50, y_pos, width - 50, y_pos)
-    
-    y_pos -= 25
-    organ = scan_results.get('organ', 'Unknown')
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(50, y_pos, "Target Organ:")
-    c.setFont("Helvetica", 11)
-    c.drawString(150, y_pos, organ)
-    
-    y_pos -= 25
+    layout.y -= 40
+    layout.section("Diagnostic Findings")
+    layout.y -= 25
+    layout.field("Target Organ:", scan_results.get('organ', 'Unknown'))
+
+    layout.y -= 25
     findings = scan_results.get('findings', [])
     if findings:
         c.setFont("Helvetica-Bold", 11)
-        c.drawString(50, y_pos, "Detected Conditions:")
-        y_pos -= 20
-        
+        c.drawString(50, layout.y, "Detected Conditions:")
+        layout.y -= 20
+
         for f in findings:
             condition = f.get('condition', 'Unknown')
             severity = f.get('severity', 'Unknown')
-            
-            # Color code severity
-            if severity.lower() == 'high':
-                severity_color = colors.red
-            elif severity.lower() == 'med' or severity.lower() == 'medium':
-                severity_color = colors.orange
-            else:
-                severity_color = colors.green
-            
-            c.setFont("Helvetica", 10)
-            c.drawString(70, y_pos, f"• {condition}")
-            c.setFillColor(severity_color)
+            lines = wrap_text(f"• {condition}", "Helvetica", 10, 350 - 70 - 10)
+            layout.ensure_space(18 * len(lines))
+
+            c.setFillColor(_severity_color(severity))
             c.setFont("Helvetica-Bold", 10)
-            c.drawString(350, y_pos, f"Severity: {severity}")
+            c.drawString(350, layout.y, f"Severity: {severity}")
             c.setFillColor(colors.black)
-            y_pos -= 18
-    
+            c.setFont("Helvetica", 10)
+            for line in lines:
+                c.drawString(70, layout.y, line)
+                layout.y -= 18
+
     # Clinical Analysis Section
-    y_pos -= 20
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, y_pos, "Clinical Analysis")
-    y_pos -= 5
-    c.setStrokeColor(colors.HexColor("#3b82f6"))
-    c.line(50, y_pos, width - 50, y_pos)
-    y_pos -= 20
-    
+    layout.y -= 20
+    layout.section("Clinical Analysis")
+    layout.y -= 20
+
     # Parse and format the deep analysis
     if deep_analysis:
+        body = []  # wrapped body lines waiting to be drawn together
+
+        def flush():
+            layout.lines(body, x=70)
+            body.clear()
+
         # Remove markdown formatting
-        clean_text = deep_analysis.replace("**", "")
-        lines = clean_text.split('\n')
-        
-        c.setFont("Helvetica", 10)
-        for line in lines:
+        for line in deep_analysis.replace("**", "").split('\n'):
             line = line.strip()
             if not line:
-                y_pos -= 10
-                continue
-                
-            # Check if we need a new page
-            if y_pos < 100:
-                c.showPage()
-                y_pos = height - 50
-            
-            # Bold section headers
-            if line.startswith("Observation:") or line.startswith("Severity:") or line.startswith("Recommendation:") or line.startswith("Risk_Percentage:"):
-                c.setFont("Helvetica-Bold", 10)
-                c.drawString(50, y_pos, line)
-                c.setFont("Helvetica", 10)
-                y_pos -= 15
+                flush()
+                layout.y -= 10
+            elif line.startswith(SECTION_HEADERS):
+                # Bold section headers
+                flush()
+                layout.paragraph(line, font="Helvetica-Bold", x=50)
             else:
-                # Wrap long lines
-                if len(line) > 85:
-                    words = line.split()
-                    current_line = ""
-                    for word in words:
-                        if len(current_line + word) < 85:
-                            current_line += word + " "
-                        else:
-                            c.drawString(70, y_pos, current_line.strip())
-                            y_pos -= 15
-                            current_line = word + " "
-                    if current_line:
-                        c.drawString(70, y_pos, current_line.strip())
-                        y_pos -= 15
-                else:
-                    c.drawString(70, y_pos, line)
-                    y_pos -= 15
-    
+                body.extend(wrap_text(line, "Helvetica", 10, width - 50 - 70))
+        flush()
+
     # Visual Evidence Section
-    if image_path:
+    if image is not None:
+        img_width, img_height = IMAGE_BOX
+        layout.y -= 20
+        layout.ensure_space(img_height + 40)
         try:
-            y_pos -= 20
-            if y_pos < 350:
-                c.showPage()
-                y_pos = height - 50
-            
-            c.setFont("Helvetica-Bold", 16)
-            c.setFillColor(colors.black)
-            c.drawString(50, y_pos, "Visual Evidence")
-            y_pos -= 5
-            c.setStrokeColor(colors.HexColor("#3b82f6"))
-            c.line(50, y_pos, width - 50, y_pos)
-            y_pos -= 15
-            
+            layout.section("Visual Evidence")
+            layout.y -= 15
+
             # Draw annotated image
-            img_width = width - 100
-            img_height = 300
-            c.drawImage(image_path, 50, y_pos - img_height, width=img_width, height=img_height, preserveAspectRatio=True, mask='auto')
-            
+            c.drawImage(_image_source(embed_image(image, image_profile)), 50, layout.y - img_height, width=img_width, height=img_height, preserveAspectRatio=True, mask='auto')
+            layout.y -= img_height
+
         except Exception as e:
             c.setFont("Helvetica", 10)
             c.setFillColor(colors.red)
-            c.drawString(50, y_pos - 20, f"Error: Could not attach visual evidence image. {str(e)}")
-    
-    # Footer
-    c.setFont("Helvetica-Oblique", 8)
-    c.setFillColor(colors.grey)
-    c.drawString(50, 30, "This report is generated by MediScan AI for diagnostic assistance purposes.")
-    c.drawRightString(width - 50, 30, "Confidential Medical Document")
-    
-    c.save()
-    buffer.seek(0)
-    return buffer.getvalue()
\ No newline at end of file
+            c.drawString(50, layout.y - 20, f"Error: Could not attach visual evidence image. {str(e)}")
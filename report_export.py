@@ -0,0 +1,208 @@
+"""
+Bulk PDF export of registry records, e.g. every cardiology report for a month:
+
+    python report_export.py --department cardiologist --since 2025-01-01 --until 2025-02-01 -o cardio_jan.zip
+    python report_export.py --department cardiologist --format pdf -o cardio.pdf
+
+ZIP export renders reports in a process pool and writes each into the
+archive as it finishes, keeping only a bounded window of reports in memory.
+Merged export draws every report onto one canvas with a bookmark per
+department and patient.
+
+Reports are rebuilt from the organ, findings and narrative stored with
+each record. Records saved before those were stored export as labelled
+registry summaries. Scan images are not kept in the registry; pass a
+folder of <patient id>.jpg/.png files with --images to include them.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from patient_db import filter_records
+from pdf_gen import IMAGE_PROFILES, create_medical_pdf, draw_medical_report
+from severity import record_severity
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+PAGE_PATTERN = re.compile(rb"/Type\s*/Page\b")
+
+
+@dataclass
+class ExportStats:
+    reports: int = 0
+    pages: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def pages_per_sec(self):
+        return self.pages / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        return (f"{self.reports} reports, {self.pages} pages, {self.bytes / 1024:.0f} KB "
+                f"in {self.seconds:.1f}s ({self.pages_per_sec:.1f} pages/sec)")
+
+
+def select_records(department=None, since=None, until=None, status=None):
+    """Registry records to export, oldest first; `until` is exclusive."""
+    return filter_records(department, status, since=since, until=until, newest_first=False)
+
+
+def is_summary(record):
+    """True for records saved before scans stored their organ and findings."""
+    return "findings" not in record
+
+
+def report_inputs(record):
+    """
+    (patient_data, scan_results, deep_analysis) for a stored record. Older
+    records without stored findings become a clearly labelled registry
+    summary rather than a report with placeholder findings.
+    """
+    patient = {k: record.get(k) for k in ("name", "age", "sex", "id", "date")}
+    if not is_summary(record):
+        scan = {"organ": record.get("organ", "Unknown"), "findings": record["findings"]}
+        analysis = record.get("narrative") or "No clinical narrative was saved with this record."
+        return patient, scan, analysis
+    scan = {
+        "organ": "Not recorded",
+        "findings": [{"condition": record.get("disease", "Unknown"), "severity": record_severity(record)}],
+    }
+    analysis = "\n".join([
+        "Registry Summary: This record was saved before scan findings were stored. "
+        "Only the registry entry is shown; it is not a clinical report.",
+        f"Department: {str(record.get('specialization', 'general')).capitalize()}",
+        f"Status: {record.get('status', 'Pending Review')}",
+    ])
+    return patient, scan, analysis
+
+
+def find_image(images_dir, pid):
+    """<images_dir>/<pid>.jpg|.jpeg|.png, if present."""
+    if not images_dir:
+        return None
+    for ext in IMAGE_EXTENSIONS:
+        path = os.path.join(images_dir, f"{pid}{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def render_report(record, image_path=None, image_profile=None):
+    """PDF bytes and page count for one record (runs in the worker processes)."""
+    pdf = create_medical_pdf(*report_inputs(record), image_path=image_path, image_profile=image_profile)
+    return pdf, len(PAGE_PATTERN.findall(pdf))
+
+
+def _safe_name(text):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", str(text)).strip("_") or "report"
+
+
+def export_zip(records, out_path, images_dir=None, workers=None, window=None, image_profile=None):
+    """
+    Renders one PDF per record in `workers` processes and streams them into
+    a ZIP at `out_path`. At most `window` reports are pending at a time.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = window or 4 * workers
+    stats = ExportStats()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            zipfile.ZipFile(out_path, "w", zipfile.ZIP_STORED) as zf:
+        pending = deque()
+        records = iter(records)
+
+        def fill():
+            for record in records:
+                pending.append((record, pool.submit(render_report, record, find_image(images_dir, record["id"]), image_profile)))
+                if len(pending) >= window:
+                    return
+
+        fill()
+        while pending:
+            record, future = pending.popleft()
+            pdf, pages = future.result()
+            # PDFs are already compressed; storing them keeps the export CPU-bound on rendering only
+            kind = "Summary" if is_summary(record) else "Report"
+            zf.writestr(f"{_safe_name(record.get('specialization'))}/{kind}_{_safe_name(record['id'])}.pdf", pdf)
+            stats.reports += 1
+            stats.pages += pages
+            fill()
+    stats.seconds = time.perf_counter() - start
+    stats.bytes = os.path.getsize(out_path)
+    return stats
+
+
+def export_merged(records, out_path, images_dir=None, image_profile=None):
+    """
+    All reports in one PDF at `out_path`, bookmarked by department and
+    patient. A scan image shared by several reports is embedded once.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    stats = ExportStats()
+    start = time.perf_counter()
+    c = canvas.Canvas(out_path, pagesize=letter)
+    c.setTitle("MediScan AI report export")
+    c.showOutline()
+    department = None
+    # Group by department so each gets one bookmark; dates stay in order within it
+    for record in sorted(records, key=lambda r: str(r.get("specialization"))):
+        if stats.reports:
+            c.showPage()
+        spec = record.get("specialization", "general")
+        if spec != department:
+            department = spec
+            c.bookmarkPage(f"dept-{spec}")
+            c.addOutlineEntry(str(spec).capitalize(), f"dept-{spec}", level=0)
+        key = f"report-{record['id']}"
+        c.bookmarkPage(key)
+        label = f"{record['id']} - {record.get('name')}"
+        c.addOutlineEntry(f"{label} (registry summary)" if is_summary(record) else label, key, level=1)
+        draw_medical_report(c, *report_inputs(record), image=find_image(images_dir, record["id"]),
+                            image_profile=image_profile)
+        stats.reports += 1
+    if stats.reports:
+        stats.pages = c.getPageNumber()
+        c.save()
+    stats.seconds = time.perf_counter() - start
+    stats.bytes = os.path.getsize(out_path) if stats.reports else 0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export registry records as PDF reports")
+    parser.add_argument("--department", help="specialization to export (default: all)")
+    parser.add_argument("--status", help="only records with this review status")
+    parser.add_argument("--since", help="first date to include, YYYY-MM-DD")
+    parser.add_argument("--until", help="first date to exclude, YYYY-MM-DD")
+    parser.add_argument("--format", choices=["zip", "pdf"], default="zip",
+                        help="zip: one PDF per record; pdf: one merged, bookmarked PDF")
+    parser.add_argument("--images", help="folder of scan images named <patient id>.jpg/.png")
+    parser.add_argument("--image-profile", choices=sorted(IMAGE_PROFILES), default=None,
+                        help="resolution/quality of embedded scans (default: MEDISCAN_PDF_PROFILE or standard)")
+    parser.add_argument("--workers", type=int, default=None, help="render processes for zip export")
+    parser.add_argument("-o", "--out", required=True)
+    args = parser.parse_args(argv)
+
+    records = select_records(args.department, args.since, args.until, args.status)
+    if not records:
+        print("No matching records", file=sys.stderr)
+        return 1
+    if args.format == "zip":
+        stats = export_zip(records, args.out, args.images, args.workers, image_profile=args.image_profile)
+    else:
+        stats = export_merged(records, args.out, args.images, image_profile=args.image_profile)
+    print(f"{args.out}: {stats.summary()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+Scan pipeline shared by the Streamlit app and the batch tools: model setup,
+the Gemini visual scan (with its result cache), response parsing, box
+annotation and turning a scan into a registry record.
+"""
+
+import copy
+import io
+import json
+import os
+import time
+
+from PIL import Image, ImageDraw
+
+from image_prep import DEFAULT_PREP, box_to_pixels, prepare_image
+from inference_cache import make_key
+from patient_db import make_patient_entry
+from utils import sanitize_text
+
+# You can change this string to "gemini-2.0-flash-exp" or "gemini-3.0-flash" as they become available
+GEMINI_MODEL_VERSION = "gemini-2.5-flash-lite"
+
+# Prompt for the visual scan; part of the result-cache key, so edit it here only
+SCAN_PROMPT = """
+                            Analyze this medical image. Return JSON ONLY:
+                            {"organ":"Name","findings":[{"condition":"Name","severity":"Low/Med/High","box":[ymin,xmin,ymax,xmax]}]}
+                            Coordinates 0-1000 scale.
+                            """
+
+# Stages analyze_image reports to its on_stage callback, in order
+SCAN_STAGES = ("decode", "resize", "inference", "parse")
+
+# Returned in simulation mode (no API key / SDK)
+SIMULATED_SCAN = {
+    "organ": "Lungs", 
+    "findings": [
+        {"condition": "Opacification", "severity": "High", "box": [200, 300, 600, 700]}
+    ]
+}
+
+ORGAN_SPECIALIZATION_MAP = {
+    # Cardiovascular
+    "heart": "cardiologist",
+
+    # Respiratory
+    "lungs": "pulmonologist",
+    "lung": "pulmonologist",
+    "chest": "pulmonologist",
+
+    # Bones & Joints (Orthopedic)
+    "bone": "orthopedist",
+    "hand": "orthopedist",
+    "wrist": "orthopedist",
+    "forearm": "orthopedist",
+    "elbow": "orthopedist",
+    "shoulder": "orthopedist",
+    "knee": "orthopedist",
+    "leg": "orthopedist",
+    "ankle": "orthopedist",
+    "foot": "orthopedist",
+    "spine": "orthopedist",
+    "ribs": "orthopedist",
+
+    # Neurological
+    "brain": "neurologist",
+    "skull": "neurologist",
+    "head": "neurologist",
+    "nerves": "neurologist",
+    "cancer": "oncologist",
+
+    # Gastrointestinal
+    "stomach": "gastroenterologist",
+    "abdomen": "gastroenterologist",
+    "liver": "hepatologist",
+    "intestine": "gastroenterologist",
+
+    # ENT
+    "ear": "ent specialist",
+    "nose": "ent specialist",
+    "throat": "ent specialist",
+    "sinus": "ent specialist",
+
+    # Eyes
+    "eye": "ophthalmologist",
+    "vision": "ophthalmologist",
+
+    # Skin
+    "skin": "dermatologist",
+    "hair": "dermatologist",
+    "nails": "dermatologist",
+    "rashes": "dermatologist",
+
+    # Urinary & Kidneys
+    "kidney": "nephrologist",
+    "urine": "urologist",
+    "bladder": "urologist",
+
+    # Reproductive
+    "ovary": "gynecologist",
+    "uterus": "gynecologist",
+    "testicles": "urologist",
+    "prostate": "urologist"
+}
+
+
+def load_gemini_model(model_version=GEMINI_MODEL_VERSION):
+    """Configured Gemini model, or None when the SDK or GEMINI_API_KEY is missing."""
+    if os.getenv("MEDISCAN_FAKE_GEMINI"):
+        import fake_gemini
+        return fake_gemini.from_env()
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        return None
+    # Attempt to get key from environment, but don't crash if missing
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return None
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_version)
+
+def decode_image(image_bytes):
+    """RGB PIL image from uploaded/archived file bytes."""
+    return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
+def parse_scan_response(text):
+    """Scan JSON from the model's reply (tolerates ```json fences)."""
+    return json.loads(sanitize_text(text))
+
+def _no_progress(stage):
+    pass
+
+def analyze_image(model, image_bytes, pil_img=None, cache=None, model_version=GEMINI_MODEL_VERSION,
+                  on_stage=None, prep=DEFAULT_PREP, info=None):
+    """
+    Runs the visual scan on one image. Returns (result, from_cache).
+    With model=None the simulated result is returned. Errors from the model
+    or the JSON parse propagate to the caller.
+    on_stage(name) is called as each of SCAN_STAGES finishes; stages a
+    cache hit or the simulation skip are reported as they are passed.
+    The image is downscaled/re-encoded per `prep` (None sends it as is);
+    `info`, if given, receives the PreparedImage and the inference time.
+    """
+    on_stage = on_stage or _no_progress
+    if model is None:
+        for stage in SCAN_STAGES:
+            on_stage(stage)
+        return copy.deepcopy(SIMULATED_SCAN), False
+    key = make_key(model_version, SCAN_PROMPT, image_bytes, prep.signature() if prep else "")
+    if cache is not None:
+        res = cache.get(key)
+        if res is not None:
+            for stage in SCAN_STAGES:
+                on_stage(stage)
+            return res, True
+    if pil_img is None:
+        pil_img = Image.open(io.BytesIO(image_bytes))
+    on_stage("decode")
+    if prep:
+        prepared = prepare_image(image_bytes, prep, pil_img=pil_img)
+        part = prepared.blob
+        if info is not None:
+            info["prepared"] = prepared
+    else:
+        part = pil_img.convert("RGB")
+    on_stage("resize")
+    start = time.perf_counter()
+    resp = model.generate_content([SCAN_PROMPT, part])
+    if info is not None:
+        info["inference_seconds"] = time.perf_counter() - start
+    on_stage("inference")
+    res = parse_scan_response(resp.text)
+    on_stage("parse")
+    if cache is not None:
+        cache.put(key, res)
+    return res, False
+
+def annotate(pil_img, result):
+    """
+    Copy of the image with each finding's 0-1000 box drawn in red. Boxes are
+    relative to the whole frame, so they land correctly on the original even
+    though the model saw a downscaled copy.
+    """
+    annotated_img = pil_img.copy()
+    draw = ImageDraw.Draw(annotated_img)
+    
+    for f in (result or {}).get("findings", []):
+        if "box" in f:
+            # Scale 1000 to image size
+            draw.rectangle(box_to_pixels(f["box"], annotated_img.size), outline="#ef4444", width=5)
+    return annotated_img
+
+class ScanImages:
+    """
+    Images derived from one uploaded file, computed once and reused on every
+    rerun: the decoded RGB image, the annotated copy and the JPEG bytes of
+    either, keyed by the analysis result they show.
+    """
+
+    JPEG_QUALITY = 90
+
+    def __init__(self, image_bytes, digest=None):
+        self.data = image_bytes
+        self.digest = digest or make_key(image_bytes)
+        self._image = None
+        self._annotated = {}
+        self._jpeg = {}
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = decode_image(self.data)
+        return self._image
+
+    @staticmethod
+    def _result_key(result):
+        return make_key(json.dumps(result, sort_keys=True)) if result else ""
+
+    def annotated(self, result):
+        """The image with `result`'s boxes drawn (the plain image when there is no result)."""
+        if not result:
+            return self.image
+        key = self._result_key(result)
+        if key not in self._annotated:
+            # Only the latest analysis of an upload is ever shown
+            self._annotated = {key: annotate(self.image, result)}
+        return self._annotated[key]
+
+    def jpeg(self, result=None):
+        """JPEG bytes of annotated(result)."""
+        key = self._result_key(result)
+        if key not in self._jpeg:
+            buf = io.BytesIO()
+            self.annotated(result).save(buf, "JPEG", quality=self.JPEG_QUALITY)
+            self._jpeg = {k: v for k, v in self._jpeg.items() if k == ""}
+            self._jpeg[key] = buf.getvalue()
+        return self._jpeg[key]
+
+def specialization_for(result):
+    """Department auto-assigned from the detected organ."""
+    detected_organ = (result or {}).get("organ", "").lower()
+    return ORGAN_SPECIALIZATION_MAP.get(detected_organ, "general")
+
+def primary_disease(result):
+    # Safely handle empty findings list
+    findings_list = (result or {}).get("findings", [])
+    return findings_list[0].get("condition", "Unknown") if findings_list else "Unknown"
+
+def narrative_prompt(result):
+    """Prompt for the clinical narrative of a scan result."""
+    organ = (result or {}).get('organ', 'Unknown')
+    findings = (result or {}).get('findings', [])
+    findings_text = ", ".join([f"{f.get('condition')} ({f.get('severity')} severity)" for f in findings])
+    return f"""You are a medical AI assistant. Analyze this diagnostic scan and provide a detailed clinical report.
+
+Scan Details:
+- Target Organ: {organ}
+- Detected Conditions: {findings_text}
+
+Provide a structured clinical analysis with the following sections:
+1. Observation: Detailed description of what is seen in the scan
+2. Severity: Assessment of the condition severity (Low/Medium/High)
+3. Recommendation: Specific medical recommendations and next steps
+4. Risk_Percentage: Estimated risk percentage (0-100)
+
+Format your response with clear section headers."""
+
+def build_record(name, age, sex, pid, result, narrative=None):
+    """
+    Registry entry for a scanned patient, department picked from the organ.
+    The organ, findings and clinical narrative (if one was generated) are
+    stored with it so reports can be rebuilt from the registry later.
+    """
+    rec = make_patient_entry(name, age, sex, pid, primary_disease(result), specialization_for(result))
+    rec["organ"] = (result or {}).get("organ", "Unknown")
+    rec["findings"] = copy.deepcopy((result or {}).get("findings", []))
+    if narrative:
+        rec["narrative"] = narrative
+    return rec
@@ -0,0 +1,277 @@
+"""
+Inverted trigram index used by patient_db.search.
+
+Each indexed record is split into lowercase trigrams per field. A query is
+answered by intersecting the posting sets of its trigrams and confirming the
+substring on the few survivors, so lookups cost roughly the size of the
+smallest posting set instead of the size of the registry.
+
+Field and word starts are also kept in sorted lists, so whole-field,
+prefix and word-prefix hits (the best ranks) come out of a bisect in rank
+order, and a limited search stops as soon as it has enough of them.
+"""
+
+import bisect
+import heapq
+
+SEARCH_FIELDS = ("name", "id", "disease")
+
+# Shorter queries have no trigram to look up, so they only get the prefix tiers,
+# which the sorted start lists answer without scanning every record.
+MIN_QUERY_LENGTH = 3
+
+# Fuzzy matches need a field holding at least this fraction of the query's trigrams.
+FUZZY_THRESHOLD = 0.6
+
+# A group search ranks its candidates directly when there are at most this many
+GROUP_SCAN_MAX = 2000
+
+
+def trigrams(text):
+    """Set of 3-character substrings of `text` (already lowercased)."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def word_starts(text):
+    """Positions after the first that follow a non-alphanumeric character."""
+    return [i for i in range(1, len(text)) if not text[i - 1].isalnum()]
+
+
+class TrigramIndex:
+    """
+    Incrementally maintained trigram index over a few text fields of each
+    record. With `group_field`, each record is also filed under that field's
+    value (e.g. its department) so searches can be restricted to one group.
+    """
+
+    def __init__(self, fields=SEARCH_FIELDS, group_field=None):
+        self.fields = fields
+        self.group_field = group_field
+        self.postings = {}   # (field number, trigram) -> set of doc numbers
+        self.docs = {}       # key -> doc number
+        self.keys = {}       # doc number -> key
+        self.texts = {}      # doc number -> tuple of lowercased field values
+        self.doc_group = {}  # doc number -> lowercased group value
+        self.groups = {}     # group value -> set of doc numbers
+        # Per field, sorted (text, doc) and (text from a word start, doc)
+        self.field_starts = [[] for _ in fields]
+        self.word_starts = [[] for _ in fields]
+        self._next_doc = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _starts(self, doc, texts):
+        """(sorted list, entry) pairs filing `doc` under its field and word starts."""
+        for field_no, text in enumerate(texts):
+            yield self.field_starts[field_no], (text, doc)
+            for pos in word_starts(text):
+                yield self.word_starts[field_no], (text[pos:], doc)
+
+    def _add(self, key, record):
+        if key in self.docs:
+            self.remove(key)
+        doc = self._next_doc
+        self._next_doc += 1
+        texts = tuple(str(record.get(f) or "").lower() for f in self.fields)
+        self.docs[key] = doc
+        self.keys[doc] = key
+        self.texts[doc] = texts
+        if self.group_field:
+            group = str(record.get(self.group_field) or "").lower()
+            self.doc_group[doc] = group
+            self.groups.setdefault(group, set()).add(doc)
+        postings = self.postings
+        for field_no, text in enumerate(texts):
+            for gram in trigrams(text):
+                posting = postings.get((field_no, gram))
+                if posting is None:
+                    postings[(field_no, gram)] = {doc}
+                else:
+                    posting.add(doc)
+        return doc, texts
+
+    def add(self, key, record):
+        doc, texts = self._add(key, record)
+        for entries, entry in self._starts(doc, texts):
+            bisect.insort(entries, entry)
+
+    def add_many(self, items):
+        """Bulk add of (key, record) pairs; the start lists are sorted once at the end."""
+        for key, record in items:
+            doc, texts = self._add(key, record)
+            for field_no, text in enumerate(texts):
+                self.field_starts[field_no].append((text, doc))
+                words = self.word_starts[field_no]
+                for pos in word_starts(text):
+                    words.append((text[pos:], doc))
+        for entries in self.field_starts + self.word_starts:
+            entries.sort()
+
+    def remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        del self.keys[doc]
+        texts = self.texts.pop(doc)
+        group = self.doc_group.pop(doc, None)
+        if group is not None:
+            members = self.groups[group]
+            members.discard(doc)
+            if not members:
+                del self.groups[group]
+        for entries, entry in self._starts(doc, texts):
+            i = bisect.bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+        for field_no, text in enumerate(texts):
+            for gram in trigrams(text):
+                posting = self.postings.get((field_no, gram))
+                if posting is not None:
+                    posting.discard(doc)
+                    if not posting:
+                        del self.postings[(field_no, gram)]
+
+    @staticmethod
+    def _order(texts, q):
+        """
+        Sort key of a hit in search() results, less the doc number. Lower is
+        better: exact field match, then field prefix, then word prefix, then
+        plain substring, each by field; the first three tiers then go by the
+        matching field or word text. None when nothing matches.
+        """
+        best = None
+        for field_no, text in enumerate(texts):
+            if q not in text:
+                continue
+            if text == q:
+                key = (0, field_no, text)
+            elif text.startswith(q):
+                key = (1, field_no, text)
+            else:
+                words = [text[pos:] for pos in word_starts(text) if text.startswith(q, pos)]
+                key = (2, field_no, min(words)) if words else (3, field_no, "")
+            if best is None or key < best:
+                best = key
+        return best
+
+    def _candidates(self, q, field_no, members=None):
+        """Docs holding every trigram of `q` in one field (and in `members`, if given): a superset of its hits."""
+        postings = [self.postings.get((field_no, g), ()) for g in trigrams(q)]
+        if members is not None:
+            postings.append(members)
+        postings.sort(key=len)
+        if not postings[0]:
+            return set()
+        return postings[0].intersection(*postings[1:])
+
+    @staticmethod
+    def _prefixed(entries, q, exact=False):
+        """Docs of the entries starting with (or, with `exact`, equal to) `q`, in sorted order."""
+        for i in range(bisect.bisect_left(entries, (q,)), len(entries)):
+            text, doc = entries[i]
+            if not (text == q if exact else text.startswith(q)):
+                return
+            yield doc
+
+    def search(self, query, limit=None, group=None):
+        """
+        Keys of records with `query` as a substring of an indexed field, best
+        matches first (see _order; ties in indexing order). Queries shorter
+        than MIN_QUERY_LENGTH only match a field or word prefix. `group`
+        restricts the search to records filed under that group value; with
+        `limit` the search stops once it has that many hits.
+        """
+        q = str(query).lower().strip()
+        if not q:
+            return []
+        short = len(q) < MIN_QUERY_LENGTH
+        if group is not None:
+            group = str(group).lower()
+            members = self.groups.get(group, set())
+            if short:
+                # No trigrams to narrow by; a small group is cheaper to rank whole
+                candidates = members if len(members) <= GROUP_SCAN_MAX else None
+            else:
+                candidates = set().union(*(self._candidates(q, f, members) for f in range(len(self.fields))))
+            if candidates is not None and (limit is None or len(candidates) <= GROUP_SCAN_MAX):
+                # Few hits in the group: rank them directly instead of walking everyone's
+                hits = ((key, doc) for doc in candidates
+                        if (key := self._order(self.texts[doc], q)) is not None and not (short and key[0] == 3))
+                hits = sorted(hits) if limit is None else heapq.nsmallest(limit, hits)
+                return [self.keys[doc] for _, doc in hits]
+
+        found, seen = [], set()
+        ranked = ([self._prefixed(e, q, exact=True) for e in self.field_starts]
+                  + [self._prefixed(e, q) for e in self.field_starts]
+                  + [self._prefixed(e, q) for e in self.word_starts])
+        for docs in ranked:
+            for doc in docs:
+                if doc in seen:
+                    continue
+                seen.add(doc)
+                if group is None or self.doc_group[doc] == group:
+                    found.append(doc)
+                    if limit is not None and len(found) >= limit:
+                        return [self.keys[d] for d in found]
+        if short:
+            return [self.keys[d] for d in found]
+
+        # Every remaining hit is a plain substring match: by field, then in indexing order
+        for field_no in range(len(self.fields)):
+            candidates = self._candidates(q, field_no, members if group is not None else None) - seen
+            hits = self._lowest_hits(candidates, q, field_no, None if limit is None else limit - len(found))
+            found.extend(hits)
+            seen.update(hits)
+            if limit is not None and len(found) >= limit:
+                break
+        return [self.keys[d] for d in found]
+
+    def _lowest_hits(self, candidates, q, field_no, count=None):
+        """The `count` lowest-numbered candidates whose field really contains `q` (all with None)."""
+        texts = self.texts
+        if count is not None:
+            lowest = heapq.nsmallest(count, candidates)
+            hits = [doc for doc in lowest if q in texts[doc][field_no]]
+            if len(hits) == count or len(lowest) == len(candidates):
+                return hits
+        hits = [doc for doc in sorted(candidates) if q in texts[doc][field_no]]
+        return hits if count is None else hits[:count]
+
+    def fuzzy(self, query, limit=None, threshold=FUZZY_THRESHOLD, group=None):
+        """
+        Keys of records with a field containing at least `threshold` of the
+        query's trigrams (typo-tolerant), ranked by the best Jaccard
+        similarity between the query and one field.
+        """
+        q = str(query).lower().strip()
+        grams = trigrams(q)
+        if len(q) < MIN_QUERY_LENGTH or not grams:
+            return []
+        needed = -int(-threshold * len(grams) // 1)
+        members = self.groups.get(str(group).lower(), set()) if group is not None else None
+        best, scores = {}, {}
+
+        def score(text):
+            # Many records share a text (a condition, a common name); score each once
+            if text not in scores:
+                field = trigrams(text)
+                common = len(grams & field)
+                scores[text] = common / (len(grams) + len(field) - common) if common >= needed else 0.0
+            return scores[text]
+
+        for field_no in range(len(self.fields)):
+            postings = sorted((self.postings.get((field_no, g), set()) for g in grams), key=len)
+            # A field holding `needed` of the grams is in one of the
+            # len(grams) - needed + 1 rarest postings
+            candidates = set().union(*postings[:len(grams) - needed + 1])
+            if members is not None:
+                candidates &= members
+            for doc in candidates:
+                similarity = score(self.texts[doc][field_no])
+                if similarity > best.get(doc, 0.0):
+                    best[doc] = similarity
+
+        hits = ((-similarity, doc) for doc, similarity in best.items())
+        hits = sorted(hits) if limit is None else heapq.nsmallest(limit, hits)
+        return [self.keys[doc] for _, doc in hits]
@@ -0,0 +1,71 @@
+"""
+Keyword-based severity classification of recorded conditions.
+
+The keyword rules are compiled once into a single regular expression.
+Results are cached per distinct disease string, and whole columns are
+classified one distinct value at a time, so dashboards and exports never
+loop over rows in Python.
+"""
+
+import re
+from functools import lru_cache
+
+# Checked in this order; the first class with a matching keyword wins.
+SEVERITY_KEYWORDS = {
+    'High': ['fracture', 'opacity', 'infiltration', 'pneumonia', 'tumor'],
+    'Medium': ['congestion', 'inflammation', 'infection'],
+    'Low': ['minor', 'slight', 'mild']
+}
+DEFAULT_SEVERITY = 'Medium'
+SEVERITY_LEVELS = list(SEVERITY_KEYWORDS)
+
+CRITICAL_KEYWORDS = ['high', 'fracture', 'opacity', 'infiltration']
+
+_KEYWORD_RANK = {}
+for _rank, _keywords in enumerate(SEVERITY_KEYWORDS.values()):
+    for _kw in _keywords:
+        _KEYWORD_RANK.setdefault(_kw, _rank)
+
+# A lookahead tries every position, so a keyword overlapping another
+# ("slightumor") cannot hide it as a consumed, non-overlapping match would.
+SEVERITY_PATTERN = re.compile('(?=(' + '|'.join(re.escape(k) for k in _KEYWORD_RANK) + '))')
+CRITICAL_PATTERN = re.compile('|'.join(re.escape(k) for k in CRITICAL_KEYWORDS))
+
+
+@lru_cache(maxsize=4096)
+def classify(disease):
+    """'High', 'Medium' or 'Low' for a disease/condition string."""
+    text = str(disease).lower()
+    ranks = [_KEYWORD_RANK[m] for m in SEVERITY_PATTERN.findall(text)]
+    return SEVERITY_LEVELS[min(ranks)] if ranks else DEFAULT_SEVERITY
+
+
+@lru_cache(maxsize=4096)
+def is_critical(disease):
+    """True when the condition matches one of CRITICAL_KEYWORDS."""
+    return CRITICAL_PATTERN.search(str(disease).lower()) is not None
+
+
+def classify_series(diseases):
+    """Severity for a whole pandas Series, classifying each distinct value once."""
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(diseases.astype(str), use_na_sentinel=False)
+    labels = np.array([classify(u) for u in uniques], dtype=object)
+    return pd.Series(labels[codes], index=diseases.index, dtype="object")
+
+
+def record_severity(record):
+    """The severity stored on the record at save time, or derived from its disease for older records."""
+    return record.get("severity") or classify(record.get("disease", ""))
+
+
+def record_is_critical(record):
+    critical = record.get("critical")
+    return critical if critical is not None else is_critical(record.get("disease", ""))
+
+
+def severity_fields(disease):
+    """Fields stored alongside a disease so dashboards don't recompute them."""
+    return {"severity": classify(disease), "critical": is_critical(disease)}
@@ -1,6 +1,7 @@
 import datetime
 import time
 import re
+from contextlib import contextmanager
 
 def timestamp_now():
     """Returns a formatted string of the current time."""
@@ -14,14 +15,55 @@ def sanitize_text(text):
     text = text.replace("```json", "").replace("```", "").strip()
     return text
 
-def simulate_progress_bar(st_obj, text, speed=0.05):
+def format_age(age):
+    """Age for display; records from batch scans without a manifest have none."""
+    return "Unknown" if age is None or age == "" else f"{age} years"
+
+def format_sex(sex):
+    """Sex for display; like age, None when a batch scan had no manifest entry."""
+    return sex or "Unknown"
+
+class StageProgress:
     """
-    Simulates a process with a progress bar.
+    Progress bar driven by real pipeline stages, with no added delay.
     st_obj: The streamlit module or a container.
+
+        with StageProgress(st, ["decode", "inference", "parse"]) as progress:
+            analyze_image(..., on_stage=progress)
+    
+    Calling the object with a stage name marks it finished; `stage(name)`
+    wraps a block of work the same way.
     """
-    progress_bar = st_obj.progress(0, text=text)
-    for percent_complete in range(100):
-        time.sleep(speed)
-        progress_bar.progress(percent_complete + 1, text=text)
-    time.sleep(0.2)
-    progress_bar.empty()
\ No newline at end of file
+
+    def __init__(self, st_obj, stages, text="Working..."):
+        self.st_obj = st_obj
+        self.stages = list(stages)
+        self.text = text
+        self.done = []
+        self.timings = {}
+        self._bar = None
+        self._started = None
+
+    def __enter__(self):
+        self._bar = self.st_obj.progress(0, text=self.text)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._bar.empty()
+        return False
+
+    def __call__(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = now - self._started
+        self._started = now
+        if stage not in self.done:
+            self.done.append(stage)
+        total = max(len(self.stages), len(self.done))
+        self._bar.progress(len(self.done) / total, text=f"{stage.capitalize()} done ({len(self.done)}/{total})")
+
+    @contextmanager
+    def stage(self, name):
+        self._bar.progress(len(self.done) / max(len(self.stages), 1), text=f"{name.capitalize()}...")
+        yield
+        self(name)